@@ -0,0 +1,408 @@
+# runs ffmpeg and opus packetizing in separate worker processes so a busy
+# guild can't slow down command handling in the bot process. the bot talks to
+# each worker over its own unix socket:
+#
+#   bot -> worker   ("start", stream_id, spec)   spec has "path" or "video_id", and optionally "start" in seconds and "gain" in dB
+#                   ("credit", stream_id, n)     the bot played n more batches, the worker may send n more
+#                   ("stop", stream_id)
+#   worker -> bot   ("packets", stream_id, [opus packets])
+#                   ("end", stream_id, error or None)
+#
+# usage: python audio_workers.py song.webm other.mp3 [--workers 2] [--kill-one]
+# plays local files through a pool as fast as possible, --kill-one kills a
+# worker after ten seconds of audio to check that its streams carry on from a new one
+
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing.connection import Client, Connection, Listener
+
+import discord
+from discord.oggparse import OggStream
+
+import externals
+import loudness
+from config import logging
+
+logger = logging.getLogger('discord')
+
+FRAME_LENGTH = 0.02
+# packets per message, one second of audio
+BATCH_SIZE = 50
+# batches a worker may send ahead of playback
+INITIAL_CREDIT = 10
+
+
+def ffmpeg_args(path: str, codec: str | None, start: float, bitrate: int, gain: float = 0.0) -> list[str]:
+    args = ["ffmpeg", "-loglevel", "warning"]
+    if start:
+        args += ["-ss", f"{start:.3f}"]
+    args += ["-i", path, "-map_metadata", "-1", "-vn", "-f", "opus"]
+    if codec == "opus" and externals.OPUS_PASSTHROUGH and not loudness.needs_transcode(gain):
+        args += ["-c:a", "copy"]
+    else:
+        if gain:
+            args += ["-af", loudness.volume_filter(gain)]
+        args += ["-c:a", "libopus", "-ar", "48000", "-ac", "2", "-b:a", f"{bitrate}k"]
+    args.append("pipe:1")
+    return args
+
+
+# worker process
+
+class WorkerStream():
+    def __init__(self, stream_id: int, spec: dict, send, fetch):
+        self.stream_id = stream_id
+        self.spec = spec
+        self.send = send
+        self.fetch = fetch
+        self.credit = threading.Semaphore(INITIAL_CREDIT)
+        self.stopped = threading.Event()
+        self.process: subprocess.Popen | None = None
+
+    def run(self):
+        import cache
+
+        error = None
+        try:
+            path = self.spec.get("path") or self.fetch(self.spec["video_id"])
+            args = ffmpeg_args(path, cache.codec_for_path(path), self.spec.get("start", 0), self.spec.get("bitrate", 128), self.spec.get("gain", 0.0))
+            self.process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+            batch = []
+            for packet in OggStream(self.process.stdout).iter_packets():
+                if packet.startswith((b"OpusHead", b"OpusTags")):
+                    continue
+                batch.append(packet)
+                if len(batch) >= BATCH_SIZE:
+                    if not self.send_batch(batch):
+                        return
+                    batch = []
+
+            if batch:
+                self.send_batch(batch)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            if self.process:
+                self.process.kill()
+                self.process.wait()
+            if not self.stopped.is_set():
+                self.send(("end", self.stream_id, error))
+
+    def send_batch(self, batch: list[bytes]) -> bool:
+        # wait until the bot has played enough to want more
+        while not self.credit.acquire(timeout=0.5):
+            if self.stopped.is_set():
+                return False
+        if self.stopped.is_set():
+            return False
+        self.send(("packets", self.stream_id, batch))
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        if self.process:
+            self.process.kill()
+
+
+def worker_main(address: str, authkey: bytes):
+    import cache
+    import pytubefix
+    import tracks
+
+    # the bot process scans and prunes the cache, every worker doing it too would race it
+    disk_cache = cache.DiskAudioCache(externals.DISK_CACHE_DIR, externals.DISK_CACHE_MAX_BYTES, owner=False)
+
+    def fetch(video_id: str) -> str:
+        if path := disk_cache.get_path(video_id):
+            return path
+
+        yt = pytubefix.YouTube(tracks.watch_url(video_id))
+        audio_stream = tracks.pick_audio_stream(yt, externals.OPUS_PASSTHROUGH)
+        audio_buffer = io.BytesIO()
+        audio_stream.stream_to_buffer(audio_buffer)
+        disk_cache.put(video_id, audio_buffer.getvalue(), audio_stream.subtype)
+        if path := disk_cache.get_path(video_id):
+            return path
+        raise RuntimeError(f"{video_id} is too large for the disk cache")
+
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        conn = listener.accept()
+
+    send_lock = threading.Lock()
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    streams: dict[int, WorkerStream] = {}
+
+    def run_stream(stream: WorkerStream):
+        try:
+            stream.run()
+        finally:
+            # finished streams are forgotten here, the bot only sends stop for ones still playing
+            if streams.get(stream.stream_id) is stream:
+                streams.pop(stream.stream_id, None)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        kind, stream_id = message[0], message[1] if len(message) > 1 else None
+        if kind == "start":
+            stream = WorkerStream(stream_id, message[2], send, fetch)
+            streams[stream_id] = stream
+            threading.Thread(target=run_stream, args=(stream,), daemon=True, name=f"stream-{stream_id}").start()
+        elif kind == "credit":
+            if stream := streams.get(stream_id):
+                stream.credit.release(message[2])
+        elif kind == "stop":
+            if stream := streams.pop(stream_id, None):
+                stream.stop()
+        elif kind == "shutdown":
+            break
+
+    for stream in list(streams.values()):
+        stream.stop()
+
+
+# bot process
+
+class WorkerAudioSource(discord.AudioSource):
+    READ_TIMEOUT = 30
+
+    def __init__(self, pool: "AudioWorkerPool", stream_id: int, spec: dict):
+        self.pool = pool
+        self.stream_id = stream_id
+        self.spec = spec
+        self.worker: WorkerHandle | None = None
+
+        self.packets: deque[bytes] = deque()
+        self.received = 0
+        self.consumed = 0
+        self.ended = False
+        self.error: str | None = None
+        self._condition = threading.Condition()
+
+    def feed(self, packets: list[bytes]):
+        with self._condition:
+            self.packets.extend(packets)
+            self.received += len(packets)
+            self._condition.notify_all()
+
+    def end(self, error: str | None):
+        with self._condition:
+            self.ended = True
+            self.error = error
+            self._condition.notify_all()
+        if error:
+            logger.error(f"Audio worker stream {self.stream_id} failed: {error}")
+
+    def read(self) -> bytes:
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.packets or self.ended, self.READ_TIMEOUT):
+                logger.error(f"Audio worker stream {self.stream_id} sent nothing for {self.READ_TIMEOUT}s, ending it")
+                return b""
+            if not self.packets:
+                return b""
+            packet = self.packets.popleft()
+            self.consumed += 1
+
+        if self.consumed % BATCH_SIZE == 0:
+            self.pool.grant_credit(self)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.pool.close_stream(self)
+
+
+class WorkerHandle():
+    def __init__(self, slot: int, socket_dir: str, authkey: bytes):
+        self.slot = slot
+        self.address = os.path.join(socket_dir, f"worker-{slot}-{uuid.uuid4().hex[:8]}.sock")
+        self.streams: dict[int, WorkerAudioSource] = {}
+        self.closing = False
+        self._send_lock = threading.Lock()
+
+        env = os.environ.copy()
+        env["LOG_FILE"] = f"logs/audio-worker-{externals.CLUSTER_ID}-{slot}.log"
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", self.address, authkey.hex()],
+            env=env, cwd=os.getcwd()
+        )
+        self.conn = self._connect(authkey)
+
+    def _connect(self, authkey: bytes) -> Connection:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"Audio worker {self.slot} did not start")
+                time.sleep(0.05)
+
+    def send(self, message) -> bool:
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def close(self):
+        self.closing = True
+        self.send(("shutdown",))
+        self.conn.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class AudioWorkerPool():
+    def __init__(self, size: int | None = None):
+        self.size = size or externals.parse_worker_count("auto")
+        self.authkey = os.urandom(16)
+        self.socket_dir = tempfile.mkdtemp(prefix="music-bot-audio-")
+        self.workers: list[WorkerHandle] = []
+        self.restarts = 0
+        self._stream_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for slot in range(self.size):
+            self.workers.append(self._spawn(slot))
+        logger.info(f"Started {self.size} audio workers")
+
+    def _spawn(self, slot: int) -> WorkerHandle:
+        worker = WorkerHandle(slot, self.socket_dir, self.authkey)
+        threading.Thread(target=self._read_worker, args=(worker,), daemon=True, name=f"audio-worker-{slot}").start()
+        return worker
+
+    def _read_worker(self, worker: WorkerHandle):
+        while True:
+            try:
+                kind, stream_id, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            source = worker.streams.get(stream_id)
+            if source is None:
+                continue
+            if kind == "packets":
+                source.feed(payload)
+            elif kind == "end":
+                worker.streams.pop(stream_id, None)
+                source.end(payload)
+
+        if not worker.closing:
+            self._replace_worker(worker)
+
+    def _replace_worker(self, dead: WorkerHandle):
+        logger.error(f"Audio worker {dead.slot} died with {len(dead.streams)} streams, replacing it")
+        # starting a process takes a while, open_stream on the event loop must not wait on the lock for it
+        try:
+            worker = self._spawn(dead.slot)
+        except RuntimeError as e:
+            logger.error(str(e))
+            for source in dead.streams.values():
+                source.end("audio worker died")
+            return
+        with self._lock:
+            self.restarts += 1
+            self.workers[dead.slot] = worker
+
+        # streams pick up on the new worker where the dead one stopped sending
+        for source in list(dead.streams.values()):
+            resume_spec = dict(source.spec, start=source.spec.get("start", 0) + source.received * FRAME_LENGTH)
+            self._start_on(worker, source, resume_spec)
+
+    def _start_on(self, worker: WorkerHandle, source: WorkerAudioSource, spec: dict):
+        source.worker = worker
+        worker.streams[source.stream_id] = source
+        if not worker.send(("start", source.stream_id, spec)):
+            worker.streams.pop(source.stream_id, None)
+            source.end("could not reach audio worker")
+
+    def open_stream(self, spec: dict) -> WorkerAudioSource:
+        with self._lock:
+            # a dead worker stays in its slot until its replacement is up
+            alive = [w for w in self.workers if w.process.poll() is None] or self.workers
+            worker = min(alive, key=lambda w: len(w.streams))
+        source = WorkerAudioSource(self, next(self._stream_ids), spec)
+        self._start_on(worker, source, spec)
+        return source
+
+    def grant_credit(self, source: WorkerAudioSource):
+        if source.worker:
+            source.worker.send(("credit", source.stream_id, 1))
+
+    def close_stream(self, source: WorkerAudioSource):
+        if source.worker and source.worker.streams.pop(source.stream_id, None):
+            source.worker.send(("stop", source.stream_id))
+
+    def active_streams(self) -> int:
+        return sum(len(worker.streams) for worker in self.workers)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def play_files(paths: list[str], workers: int, kill_one: bool):
+    pool = AudioWorkerPool(workers)
+    pool.start()
+
+    start = time.perf_counter()
+    sources = [pool.open_stream({"path": os.path.abspath(path)}) for path in paths]
+    killed = False
+    counts = [0] * len(sources)
+    done = [False] * len(sources)
+
+    while not all(done):
+        for i, source in enumerate(sources):
+            if done[i]:
+                continue
+            if source.read():
+                counts[i] += 1
+            else:
+                done[i] = True
+
+        if kill_one and not killed and min(counts) > 10 * BATCH_SIZE:
+            killed = True
+            victim = pool.workers[0]
+            logger.warning(f"Killing audio worker {victim.slot}")
+            victim.process.kill()
+
+    for path, source, count in zip(paths, sources, counts):
+        print(f"{path}: {count} packets ({count * FRAME_LENGTH:.1f}s of audio), error: {source.error}")
+    print(f"{time.perf_counter() - start:.2f}s wall time, {pool.restarts} worker restarts")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        worker_main(sys.argv[2], bytes.fromhex(sys.argv[3]))
+    else:
+        import argparse
+
+        parser = argparse.ArgumentParser(description="Play local audio files through the audio worker pool")
+        parser.add_argument("files", nargs="+")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--kill-one", action="store_true", help="kill a worker after ten seconds of audio")
+        args = parser.parse_args()
+        play_files(args.files, args.workers, args.kill_one)
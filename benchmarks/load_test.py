@@ -0,0 +1,394 @@
+# offline load test, no discord or youtube needed. pytubefix is swapped for a
+# fake that serves local audio, voice clients are fakes driven by one player
+# thread, and the real command handlers from main.py are called with fake
+# interactions. every simulated guild runs /play, /queue and /skip
+#
+# usage: python benchmarks/load_test.py [--guilds 200] [--duration 30] [--catalog 50]
+#   --fixture song.webm   serve this file for every video instead of generated bytes
+#   --real-audio          play through real ffmpeg sources (needs ffmpeg and --fixture)
+#   --download-ms 200     simulated youtube download time per song
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# the bot reads its settings from the environment when it is imported
+WORK_DIR = tempfile.mkdtemp(prefix="music-bot-load-test-")
+os.environ.update({
+    "DISK_CACHE_DIR": os.path.join(WORK_DIR, "audio"),
+    "TITLE_INDEX_PATH": os.path.join(WORK_DIR, "title_index.json"),
+    "AUDIO_WORKERS": "0",
+    "METRICS_PORT": "0",
+    "LOUDNESS_NORMALIZATION": "false",
+    # encoding for broadcast needs ffmpeg, set BROADCAST=true with --real-audio to include it
+    "BROADCAST": os.getenv("BROADCAST", "false"),
+    "LOG_FILE": os.path.join(WORK_DIR, "bot.log")
+})
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(WORK_DIR)
+
+import discord
+import pytubefix
+
+FRAME_LENGTH = 0.02
+# bytes the fake source takes from the song per 20ms frame, about 160kbps
+FRAME_BYTES = 400
+
+
+# fake youtube
+
+class FakeStream():
+    def __init__(self, data: bytes, download_seconds: float):
+        self.data = data
+        self.download_seconds = download_seconds
+        self.audio_codec = "opus"
+        self.subtype = "webm"
+        self.itag = 251
+        self.abr = "160kbps"
+        self.filesize = len(data)
+
+    def stream_to_buffer(self, buffer):
+        chunks = 16
+        chunk_size = -(-len(self.data) // chunks)
+        for i in range(0, len(self.data), chunk_size):
+            time.sleep(self.download_seconds / chunks)
+            buffer.write(self.data[i:i + chunk_size])
+
+
+class FakeStreamQuery():
+    def __init__(self, streams: list[FakeStream]):
+        self.streams = streams
+
+    def filter(self, **kwargs) -> "FakeStreamQuery":
+        return self
+
+    def order_by(self, attribute: str) -> "FakeStreamQuery":
+        return self
+
+    def desc(self) -> "FakeStreamQuery":
+        return self
+
+    def first(self) -> FakeStream | None:
+        return self.streams[0] if self.streams else None
+
+
+class FakeYouTube():
+    fixture = b""
+    download_seconds = 0.0
+    requests = 0
+
+    def __init__(self, url: str, *args, **kwargs):
+        FakeYouTube.requests += 1
+        self.video_id = pytubefix.extract.video_id(url)
+        self.title = f"Fake song {self.video_id}"
+        self.author = "Load test"
+        self.length = int(len(self.fixture) / FRAME_BYTES * FRAME_LENGTH)
+
+    @property
+    def streams(self) -> FakeStreamQuery:
+        return FakeStreamQuery([FakeStream(self.fixture, self.download_seconds)])
+
+
+# fake voice
+
+class FakeAudioSource(discord.AudioSource):
+    # stands in for the ffmpeg sources, reads the song at the rate ffmpeg would
+    def __init__(self, source, *args, pipe: bool = False, **kwargs):
+        self.file = source if pipe else open(source, "rb")
+
+    def read(self) -> bytes:
+        data = self.file.read(FRAME_BYTES)
+        return b"\0" * 3840 if data else b""
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        self.file.close()
+
+
+class FakeVoiceClient():
+    def __init__(self, channel: "FakeChannel", player: "Player"):
+        self.channel = channel
+        self.player = player
+        self.source: discord.AudioSource | None = None
+        self.after = None
+        self.paused = False
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def is_playing(self) -> bool:
+        return self.source is not None and not self.paused
+
+    def is_paused(self) -> bool:
+        return self.source is not None and self.paused
+
+    def play(self, source: discord.AudioSource, after=None):
+        self.source = source
+        self.after = after
+        self.player.add(self)
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        self.player.finish(self)
+
+    async def disconnect(self, force: bool = False):
+        self.player.finish(self, call_after=False)
+        self.connected = False
+
+
+class Player():
+    # one thread plays every fake voice client, like discord's player threads but cheaper to run hundreds of
+    def __init__(self):
+        self.clients: set[FakeVoiceClient] = set()
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.stream_ticks = 0
+        self.stopped = threading.Event()
+
+    def add(self, client: FakeVoiceClient):
+        with self.lock:
+            self.clients.add(client)
+
+    def finish(self, client: FakeVoiceClient, call_after: bool = True):
+        with self.lock:
+            if client not in self.clients:
+                return
+            self.clients.discard(client)
+        source, after = client.source, client.after
+        client.source = client.after = None
+        source.cleanup()
+        if call_after and after:
+            after(None)
+
+    def run(self):
+        next_tick = time.perf_counter()
+        while not self.stopped.is_set():
+            with self.lock:
+                clients = [client for client in self.clients if not client.paused]
+            self.stream_ticks += len(clients)
+            for client in clients:
+                source = client.source
+                if source is None:
+                    continue
+                if source.read():
+                    self.frames += 1
+                else:
+                    self.finish(client)
+
+            next_tick += FRAME_LENGTH
+            time.sleep(max(0, next_tick - time.perf_counter()))
+
+
+# fake discord objects
+
+class FakePermissions():
+    administrator = True
+    manage_guild = True
+
+
+class FakeChannel():
+    def __init__(self, guild: "FakeGuild", player: Player):
+        self.guild = guild
+        self.id = guild.id
+        self.player = player
+        self.members = []
+
+    async def connect(self, self_deaf: bool = False, **kwargs) -> FakeVoiceClient:
+        return FakeVoiceClient(self, self.player)
+
+
+class FakeGuild():
+    def __init__(self, guild_id: int, player: Player):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.shard_id = 0
+        self.roles = []
+        self.voice_channel = FakeChannel(self, player)
+
+    def get_role(self, role_id: int):
+        return None
+
+
+class FakeMember():
+    def __init__(self, guild: FakeGuild):
+        self.id = guild.id * 10
+        self.guild = guild
+        self.guild_permissions = FakePermissions()
+        self.roles = []
+        self.voice = type("VoiceState", (), {"channel": guild.voice_channel})()
+        self.mention = f"<@{self.id}>"
+
+
+class FakeMessage():
+    edits = 0
+
+    async def edit(self, **kwargs):
+        FakeMessage.edits += 1
+        return self
+
+
+class FakeResponse():
+    def __init__(self):
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def send_message(self, **kwargs):
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        pass
+
+
+class FakeFollowup():
+    async def send(self, **kwargs) -> FakeMessage:
+        return FakeMessage()
+
+
+class FakeInteraction():
+    def __init__(self, guild: FakeGuild, user: FakeMember):
+        self.guild = guild
+        self.user = user
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.command = None
+
+    async def delete_original_response(self):
+        pass
+
+
+# load test
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+async def run_guild(main, guild: FakeGuild, catalog: list[str], latencies: dict[str, list[float]], end_time: float):
+    user = FakeMember(guild)
+
+    async def command(name: str, callback, *args):
+        start = time.perf_counter()
+        await callback(FakeInteraction(guild, user), *args)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    # spread the guilds out a little like real traffic
+    await asyncio.sleep(random.random())
+    while time.perf_counter() < end_time:
+        action = random.random()
+        if action < 0.6:
+            await command("play", main.play.callback, random.choice(catalog), None)
+        elif action < 0.85:
+            await command("queue", main.queue.callback)
+        else:
+            await command("skip", main.skip.callback)
+        await asyncio.sleep(random.uniform(0.5, 2))
+
+async def load_test(args: argparse.Namespace):
+    pytubefix.YouTube = FakeYouTube
+
+    if args.fixture:
+        with open(args.fixture, "rb") as file:
+            FakeYouTube.fixture = file.read()
+    else:
+        FakeYouTube.fixture = os.urandom(int(args.song_seconds / FRAME_LENGTH * FRAME_BYTES))
+    FakeYouTube.download_seconds = args.download_ms / 1000
+
+    if not args.real_audio:
+        discord.FFmpegPCMAudio = FakeAudioSource
+        discord.FFmpegOpusAudio = FakeAudioSource
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+
+    import main
+
+    main.bot.loop = asyncio.get_running_loop()
+
+    player = Player()
+    player_thread = threading.Thread(target=player.run, daemon=True, name="fake-player")
+    player_thread.start()
+
+    catalog = [f"https://youtu.be/{i:011d}" for i in range(args.catalog)]
+    guilds = [FakeGuild(1000 + i, player) for i in range(args.guilds)]
+    latencies: dict[str, list[float]] = {}
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    end_time = wall_start + args.duration
+    await asyncio.gather(*(run_guild(main, guild, catalog, latencies, end_time) for guild in guilds))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    player.stopped.set()
+    player_thread.join()
+
+    memory = tracemalloc.take_snapshot().compare_to(baseline, "filename")
+    allocated = sum(stat.size_diff for stat in memory)
+    tracemalloc.stop()
+
+    print(f"{args.guilds} guilds for {wall:.1f}s, {FakeYouTube.requests} fake youtube requests, {FakeMessage.edits} message edits")
+    print()
+    print(f"{'command':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, values in sorted(latencies.items()):
+        print(f"{name:<10}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.95) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+    print()
+
+    active_streams = player.stream_ticks / max(1, wall / FRAME_LENGTH)
+    print(f"memory: {allocated / 1024 / 1024:.1f} MiB allocated, {allocated / args.guilds / 1024:.1f} KiB per guild, "
+          f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+    print(f"cpu: {cpu:.2f}s over {wall:.1f}s, {active_streams:.1f} streams on average, "
+          f"{cpu / wall / max(active_streams, 1) * 100:.3f}% of a core per stream")
+    for name, stats in main.cache_stats().items():
+        total = stats["hits"] + stats["misses"]
+        print(f"{name} cache: {stats['hits']}/{total} hits ({stats['hits'] / total * 100 if total else 0:.0f}%), "
+              f"{stats.get('evictions', 0)} evictions")
+
+    print(f"bot logs and caches are in {WORK_DIR}")
+
+    main.song_resolver.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the music bot")
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of simulated traffic")
+    parser.add_argument("--catalog", type=int, default=50, help="number of different videos requested")
+    parser.add_argument("--song-seconds", type=float, default=20, help="length of the generated songs")
+    parser.add_argument("--download-ms", type=float, default=200)
+    parser.add_argument("--fixture", help="local audio file served for every video")
+    parser.add_argument("--real-audio", action="store_true", help="play through real ffmpeg sources")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.real_audio and not args.fixture:
+        parser.error("--real-audio needs a real audio file in --fixture")
+
+    random.seed(args.seed)
+    asyncio.run(load_test(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# compares the cpu cost of the two playback paths on a local file:
+#   transcode   - ffmpeg decodes to pcm, discord.py encodes every 20ms frame to opus
+#   passthrough - ffmpeg copies the opus packets out of the container
+#
+# usage: python benchmarks/playback_cpu.py song.webm [--seconds 60]
+# the file should be opus in webm (what youtube serves) for the passthrough numbers to mean anything
+
+import argparse
+import resource
+import sys
+import time
+
+import discord
+from discord.opus import Encoder
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(source: discord.AudioSource, max_frames: int, encoder: Encoder | None) -> dict[str, float]:
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    child_start = children_cpu()
+
+    frames = 0
+    while frames < max_frames and (data := source.read()):
+        if encoder and not source.is_opus():
+            encoder.encode(data, Encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    source.cleanup()
+
+    return {
+        "frames": frames,
+        "audio_seconds": frames * Encoder.FRAME_LENGTH / 1000,
+        "wall_seconds": time.perf_counter() - wall_start,
+        "bot_cpu_seconds": time.process_time() - cpu_start,
+        "ffmpeg_cpu_seconds": children_cpu() - child_start
+    }
+
+
+def report(name: str, result: dict[str, float]):
+    total_cpu = result["bot_cpu_seconds"] + result["ffmpeg_cpu_seconds"]
+    per_stream = total_cpu / result["audio_seconds"] * 100 if result["audio_seconds"] else 0
+    print(
+        f"{name:<12} {result['audio_seconds']:8.1f}s audio "
+        f"{result['bot_cpu_seconds']:7.2f}s bot cpu "
+        f"{result['ffmpeg_cpu_seconds']:7.2f}s ffmpeg cpu "
+        f"{per_stream:6.2f}% of a core per stream"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU benchmark of transcoded vs opus passthrough playback")
+    parser.add_argument("file", help="local audio file, ideally opus in webm")
+    parser.add_argument("--seconds", type=float, default=60, help="how much audio to play through each path")
+    args = parser.parse_args()
+
+    if not discord.opus.is_loaded() and not discord.opus._load_default():
+        sys.exit("libopus could not be loaded, it is needed to measure the transcode path")
+
+    max_frames = int(args.seconds * 1000 / Encoder.FRAME_LENGTH)
+
+    transcode = run(discord.FFmpegPCMAudio(args.file), max_frames, Encoder())
+    passthrough = run(discord.FFmpegOpusAudio(args.file, codec="copy"), max_frames, None)
+
+    report("transcode", transcode)
+    report("passthrough", passthrough)
+
+
+if __name__ == "__main__":
+    main()
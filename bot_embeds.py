@@ -55,4 +55,75 @@ def no_search_results():
     return Embed(color=0xb90505, title="No search results", description="No results found for the search query")
 
 def command_not_found():
-    return Embed(color=0xb90505, title="Command not found", description="The command you entered does not exist")
\ No newline at end of file
+    return Embed(color=0xb90505, title="Command not found", description="The command you entered does not exist")
+
+def song_load_failed():
+    return Embed(color=0xb90505, title="Could not load song", description="The video could not be loaded, check the link and try again")
+
+
+def queue_line(name: str, author: str, duration: int) -> str:
+    minutes, seconds = divmod(duration, 60)
+    line = f"{name} - {author}"
+    # keep every line short so a full page stays far below the description limit
+    if len(line) > 80:
+        line = line[:79] + "…"
+    return f"{line} [{minutes}:{seconds:02}]" if duration else line
+
+def queue_page(lines: tuple[str, ...], start: int, total: int, page: int, pages: int):
+    r_embed = Embed(color=0xffeb00, title=f"Queue ({total} Songs)")
+    r_embed.description = '**Next song will be played after the current one finishes**'
+    r_embed.description += "".join(f"```{start + i + 1}. {line}```" for i, line in enumerate(lines))
+    r_embed.set_footer(text=f"Page {page + 1}/{pages}")
+
+    return r_embed
+
+def invalid_position(queue_size: int):
+    return Embed(color=0xb90505, title="Invalid position", description=f"Pick a position between 1 and {queue_size}")
+
+def invalid_seek(duration: int):
+    r_embed = Embed(color=0xb90505, title="Invalid time", description="Give a time like 1:30 or 90")
+    if duration:
+        minutes, seconds = divmod(duration, 60)
+        r_embed.description += f" before the end of the song at {minutes}:{seconds:02}"
+    return r_embed
+
+def seeked(name: str, position: int):
+    minutes, seconds = divmod(position, 60)
+    return Embed(color=0x2ebd3f, title=f"Skipped to {minutes}:{seconds:02}", description=f"```{name}```")
+
+def song_removed(name: str):
+    return Embed(color=0x2ebd3f, title="Song removed", description=f"```{name}```")
+
+def playlist_progress(added: int, failed: int, found: int, done: bool):
+    r_embed = Embed(color=0x2ebd3f if done else 0xffeb00, title="Playlist added 🎵" if done else "Adding playlist...")
+    r_embed.description = f"**Songs added to queue: {added}/{found}**"
+    if failed:
+        r_embed.description += f"\n{failed} songs could not be loaded"
+
+    return r_embed
+
+def shard_status(cluster_id: int, current_shard: int, shards: list[tuple[int, float, int]]):
+    r_embed = Embed(color=0x16acac, title=f"Cluster {cluster_id} shards")
+    lines = []
+    for shard_id, latency, guilds in shards:
+        # latency is inf until the shard's first heartbeat
+        latency_text = f"{latency * 1000:.0f}ms" if latency != float("inf") else "connecting"
+        marker = " ◀" if shard_id == current_shard else ""
+        lines.append(f"Shard {shard_id}: {latency_text}, {guilds} guilds{marker}")
+    r_embed.description = "```" + "\n".join(lines) + "```"
+
+    return r_embed
+
+def stats(activity: dict[str, int], latencies: dict[str, tuple[float, float]], caches: dict[str, dict[str, float]]):
+    r_embed = Embed(color=0x16acac, title="Bot statistics 📊")
+    r_embed.add_field(name="Activity", value="\n".join(f"{name}: **{value}**" for name, value in activity.items()), inline=False)
+    r_embed.add_field(name="Latency (p50 / p95)", value="\n".join(f"{name}: **{p50:g}s / {p95:g}s**" for name, (p50, p95) in latencies.items()), inline=False)
+
+    cache_lines = []
+    for name, cache_stats in caches.items():
+        total = cache_stats["hits"] + cache_stats["misses"]
+        hit_rate = cache_stats["hits"] / total * 100 if total else 0
+        cache_lines.append(f"{name.capitalize()}: **{hit_rate:.0f}%** hit rate ({total} lookups)")
+    r_embed.add_field(name="Caches", value="\n".join(cache_lines), inline=False)
+
+    return r_embed
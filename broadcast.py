@@ -0,0 +1,229 @@
+# songs from the disk cache are encoded to opus packets once and kept in
+# memory, every guild playing the song reads the same packets through its own
+# cursor. a guild replaying a song or joining one that is already playing
+# elsewhere starts no ffmpeg and encodes nothing. the encoding runs in the
+# audio worker pool when there is one, otherwise ffmpeg is read in this process
+import os
+import subprocess
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterator
+
+import discord
+from discord.oggparse import OggStream
+
+import audio_workers
+import cache
+from config import logging
+
+logger = logging.getLogger('discord')
+
+FRAME_LENGTH = 0.02
+# a reader gives up on an encoder that has sent nothing for this long
+READ_TIMEOUT = 30
+# readers are woken once per this many packets while a song is still encoding
+NOTIFY_EVERY = 50
+# bytes of offsets kept for every packet of a finished track
+OFFSET_SIZE = array("I").itemsize
+
+
+class PacketTrack():
+    def __init__(self, key: tuple[str, float]):
+        self.key = key
+        # filled by the encoder, swapped for data and offsets once the song is done
+        self.packets: list[bytes] | None = []
+        # every packet back to back and where each one starts, no object per packet
+        self.data: bytes | None = None
+        self.offsets: array | None = None
+        self.size = 0
+        self.complete = False
+        self.error: Exception | None = None
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1 if self.offsets is not None else len(self.packets)
+
+    def append(self, packets: list[bytes]):
+        with self._condition:
+            self.packets.extend(packets)
+            self._condition.notify_all()
+
+    def finish(self):
+        packets = self.packets
+        offsets = array("I", [0])
+        for packet in packets:
+            offsets.append(offsets[-1] + len(packet))
+
+        with self._condition:
+            self.data = b"".join(packets)
+            self.offsets = offsets
+            self.size = len(self.data) + offsets.itemsize * len(offsets)
+            self.packets = None
+            self.complete = True
+            self._condition.notify_all()
+
+    def fail(self, error: Exception):
+        with self._condition:
+            self.error = error
+            self.complete = True
+            self._condition.notify_all()
+
+    def get(self, index: int) -> bytes | None:
+        # None once index is past the end of the song, waits for the encoder if it hasn't got there yet
+        with self._condition:
+            if not self._condition.wait_for(lambda: index < len(self) or self.complete, READ_TIMEOUT):
+                logger.error(f"Broadcast encoder for {self.key[0]} sent nothing for {READ_TIMEOUT}s")
+                return None
+            if index >= len(self):
+                return None
+            if self.data is not None:
+                return self.data[self.offsets[index]:self.offsets[index + 1]]
+            return self.packets[index]
+
+
+class PacketStore():
+    def __init__(self, max_bytes: int, pool: "audio_workers.AudioWorkerPool | None" = None, bitrate: int = 128):
+        self.max_bytes = max_bytes
+        self.pool = pool
+        self.bitrate = bitrate
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # (video_id, gain): track, a hit moves it to the end. tracks still encoding are in here too
+        self._tracks: OrderedDict[tuple[str, float], PacketTrack] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimate_size(self, path: str, duration: float) -> int:
+        # a copied stream is about as big as the file, a transcoded one about bitrate * duration
+        return max(os.path.getsize(path), int(duration * self.bitrate * 125)) + int(duration / FRAME_LENGTH) * OFFSET_SIZE
+
+    def open(self, video_id: str, path: str, gain: float = 0.0, duration: float = 0.0) -> PacketTrack | None:
+        # None when the song is too large for the store, it is then played without broadcasting
+        key = (video_id, gain)
+        with self._lock:
+            if (track := self._tracks.get(key)) is not None and track.error is None:
+                self._tracks.move_to_end(key)
+                self.hits += 1
+                return track
+
+            self.misses += 1
+            try:
+                size = self.estimate_size(path, duration)
+            except OSError:
+                return None
+            if size > self.max_bytes:
+                logger.info(f"Not broadcasting {video_id}, about {size} bytes is larger than the broadcast budget")
+                return None
+            track = self._tracks[key] = PacketTrack(key)
+
+        threading.Thread(target=self._encode, args=(track, path, gain), daemon=True, name=f"broadcast-{video_id}").start()
+        return track
+
+    def _packets(self, path: str, gain: float) -> Iterator[bytes]:
+        if self.pool is not None:
+            # read as fast as the worker sends, every packet read gives it credit for more
+            source = self.pool.open_stream({"path": path, "gain": gain, "bitrate": self.bitrate})
+            try:
+                while packet := source.read():
+                    yield packet
+                if source.error or not source.ended:
+                    raise RuntimeError(source.error or "the audio worker stopped sending")
+            finally:
+                source.cleanup()
+            return
+
+        args = audio_workers.ffmpeg_args(path, cache.codec_for_path(path), 0, self.bitrate, gain)
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        try:
+            for packet in OggStream(process.stdout).iter_packets():
+                if not packet.startswith((b"OpusHead", b"OpusTags")):
+                    yield packet
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+        finally:
+            process.kill()
+            process.wait()
+
+    def _encode(self, track: PacketTrack, path: str, gain: float):
+        try:
+            batch = []
+            for packet in self._packets(path, gain):
+                batch.append(packet)
+                if len(batch) >= NOTIFY_EVERY:
+                    track.append(batch)
+                    batch = []
+            track.append(batch)
+        except Exception as e:
+            logger.error(f"Failed to encode {track.key[0]} for broadcast: {e}")
+            track.fail(e)
+            with self._lock:
+                if self._tracks.get(track.key) is track:
+                    del self._tracks[track.key]
+            return
+
+        track.finish()
+        with self._lock:
+            if self._tracks.get(track.key) is not track:
+                return
+            if track.size > self.max_bytes:
+                # bigger than estimated, the guilds playing it keep it but nothing else is evicted for it
+                del self._tracks[track.key]
+                logger.warning(f"Not keeping {track.key[0]} in the broadcast store, {track.size} bytes is larger than the broadcast budget")
+                return
+            self.current_bytes += track.size
+            self._prune()
+        logger.info(f"Encoded {track.key[0]} for broadcast, {len(track)} packets ({track.size} bytes)")
+
+    def _prune(self):
+        # guilds still playing an evicted track keep it alive until they finish
+        for key in list(self._tracks):
+            if self.current_bytes <= self.max_bytes:
+                break
+            track = self._tracks[key]
+            if not track.complete:
+                continue
+            del self._tracks[key]
+            self.current_bytes -= track.size
+            self.evictions += 1
+            logger.info(f"Evicted {key[0]} from the broadcast store ({track.size} bytes)")
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._tracks),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# one guild's cursor into a shared track, reading a packet is an index into memory
+class BroadcastSource(discord.AudioSource):
+    def __init__(self, track: PacketTrack, start: float = 0.0):
+        self.track = track
+        self.index = int(start / FRAME_LENGTH)
+
+    def read(self) -> bytes:
+        if self.track is None:
+            return b""
+        packet = self.track.get(self.index)
+        if packet is None:
+            return b""
+        self.index += 1
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        # an evicted track is freed once the last guild playing it lets go
+        self.track = None
@@ -0,0 +1,453 @@
+import bisect
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import seek_index
+from config import logging
+
+logger = logging.getLogger('discord')
+
+# youtube only serves opus audio in webm and aac in mp4
+EXTENSION_CODECS = {"webm": "opus", "mp4": "mp4a", "m4a": "mp4a"}
+
+def codec_for_path(path: str) -> str | None:
+    return EXTENSION_CODECS.get(path.rpartition(".")[2])
+
+
+class CacheEntry():
+    __slots__ = ("data", "size", "codec")
+
+    def __init__(self, data: bytes, codec: str | None = None):
+        self.data = data
+        self.size = len(data)
+        self.codec = codec
+
+
+class AudioCache():
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # oldest entry first, a hit moves the entry to the end
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        # songs are loaded on the resolver threads so every access is locked
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, data: bytes, codec: str | None = None):
+        entry = CacheEntry(data, codec)
+        if entry.size > self.max_bytes:
+            logger.warning(f"Not caching {key}, {entry.size} bytes is larger than the cache budget")
+            return
+
+        with self._lock:
+            if old := self._entries.pop(key, None):
+                self.current_bytes -= old.size
+
+            self._entries[key] = entry
+            self.current_bytes += entry.size
+
+            while self.current_bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+                logger.info(f"Evicted {evicted_key} from audio cache ({evicted.size} bytes)")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+class DiskEntry():
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+
+# audio files stored as <video_id>.<extension>, the access time of a file is its
+# modification time so the lru order survives a restart
+class DiskAudioCache():
+    TEMP_SUFFIX = ".part"
+    # seek index of the song with the same video_id, removed with it
+    INDEX_SUFFIX = ".idx"
+    # a temp file nobody has written to for this long was left behind by a crash,
+    # younger ones can belong to another process sharing the directory
+    STALE_TEMP_SECONDS = 600
+
+    def __init__(self, directory: str, max_bytes: int, owner: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # only the owner scans the directory and removes files from it, other processes just read and add songs
+        self.owner = owner
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[str, DiskEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        if owner:
+            self.scan()
+
+    def scan(self):
+        # only stats the files, the audio itself is never read here
+        found: list[tuple[float, str, DiskEntry]] = []
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.is_file():
+                    continue
+
+                try:
+                    stat = dir_entry.stat()
+                except FileNotFoundError:
+                    # renamed or removed by another process sharing the directory
+                    continue
+
+                if dir_entry.name.endswith(self.TEMP_SUFFIX):
+                    if now - stat.st_mtime > self.STALE_TEMP_SECONDS:
+                        # left behind by a crash in the middle of a write
+                        self._remove_file(dir_entry.path)
+                    continue
+                if dir_entry.name.endswith(self.INDEX_SUFFIX):
+                    continue
+
+                video_id, _, _ = dir_entry.name.partition(".")
+                found.append((stat.st_mtime, video_id, DiskEntry(dir_entry.path, stat.st_size)))
+
+        found.sort(key=lambda item: item[0])
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            for _, video_id, entry in found:
+                self._entries[video_id] = entry
+                self.current_bytes += entry.size
+
+        logger.info(f"Disk audio cache has {len(found)} songs ({self.current_bytes} bytes)")
+        self.prune()
+
+    def get_path(self, video_id: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None and not os.path.exists(entry.path):
+                # deleted from outside the bot or pruned by another process
+                self.current_bytes -= self._entries.pop(video_id).size
+                entry = None
+
+            if entry is None:
+                entry = self._adopt(video_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+
+        try:
+            os.utime(entry.path)
+        except OSError:
+            pass
+        return entry.path
+
+    def _adopt(self, video_id: str) -> DiskEntry | None:
+        # other bot processes share the directory, pick up a file one of them wrote
+        for extension in EXTENSION_CODECS:
+            path = os.path.join(self.directory, f"{video_id}.{extension}")
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+            entry = DiskEntry(path, size)
+            self._entries[video_id] = entry
+            self.current_bytes += size
+            return entry
+        return None
+
+    def put(self, video_id: str, data: bytes, extension: str):
+        if len(data) > self.max_bytes:
+            logger.warning(f"Not caching {video_id} on disk, {len(data)} bytes is larger than the cache budget")
+            return
+
+        path = os.path.join(self.directory, f"{video_id}.{extension}")
+
+        # write next to the final file and rename it over, a crash never leaves a partial song behind
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{video_id}.", suffix=self.TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove_file(temp_path)
+            raise
+
+        with self._lock:
+            if old := self._entries.pop(video_id, None):
+                self.current_bytes -= old.size
+                if old.path != path:
+                    self._remove_file(old.path)
+            self._entries[video_id] = DiskEntry(path, len(data))
+            self.current_bytes += len(data)
+
+        # indexed once here so a seek never has to read the song from the start
+        if extension == "webm" and (index := seek_index.build_webm_index(data)) is not None:
+            self.put_index(video_id, index)
+
+        self.prune()
+
+    def index_path(self, video_id: str) -> str:
+        return os.path.join(self.directory, video_id + self.INDEX_SUFFIX)
+
+    def put_index(self, video_id: str, index: seek_index.SeekIndex):
+        index.save(self.index_path(video_id))
+
+    def get_index(self, video_id: str) -> seek_index.SeekIndex | None:
+        return seek_index.SeekIndex.load(self.index_path(video_id))
+
+    def prune(self):
+        if not self.owner:
+            return
+        with self._lock:
+            while self.current_bytes > self.max_bytes:
+                video_id, entry = self._entries.popitem(last=False)
+                self.current_bytes -= entry.size
+                self.evictions += 1
+                self._remove_file(entry.path)
+                self._remove_file(self.index_path(video_id))
+                logger.info(f"Removed {video_id} from disk audio cache ({entry.size} bytes)")
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, video_id: str) -> bool:
+        with self._lock:
+            return video_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# read only file object over cached audio, every player shares the same bytes
+# and read() hands out memoryview slices instead of copies
+class SharedBufferReader(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, min(self._pos, len(self._view)))
+        return self._pos
+
+    def read(self, size: int = -1) -> memoryview:
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        chunk = self._view[self._pos:self._pos + size]
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+# a cached song starting from a seek point, the container header followed by the
+# audio from the cluster the seek landed in. neither part is copied
+class SplicedBufferReader(SharedBufferReader):
+    def __init__(self, data: bytes, header_size: int, offset: int):
+        super().__init__(data)
+        self._header_size = header_size
+        self._offset = offset
+        self._length = header_size + len(self._view) - offset
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            offset, whence = self._length + offset, io.SEEK_SET
+        super().seek(offset, whence)
+        self._pos = min(self._pos, self._length)
+        return self._pos
+
+    def read(self, size: int = -1) -> memoryview | bytes:
+        if size is None or size < 0:
+            size = self._length - self._pos
+        if self._pos < self._header_size and self._pos + size > self._header_size:
+            # the read crosses from the header into the audio, the only read that has to copy
+            header = self._view[self._pos:self._header_size]
+            self._pos = self._header_size
+            return bytes(header) + bytes(self.read(size - len(header)))
+        if self._pos < self._header_size:
+            chunk = self._view[self._pos:self._pos + size]
+        else:
+            start = self._offset + self._pos - self._header_size
+            chunk = self._view[start:start + size]
+        self._pos += len(chunk)
+        return chunk
+
+
+# audio that is still being downloaded, the downloader writes chunks while any
+# number of readers follow behind it. chunks are never modified once written so
+# readers can hold views into them without a lock
+class GrowingBuffer():
+    def __init__(self, codec: str | None = None):
+        self.codec = codec
+        self._chunks: list[bytes] = []
+        self._chunk_starts: list[int] = []
+        self.size = 0
+        self.finished = False
+        self.error: BaseException | None = None
+        self._condition = threading.Condition()
+
+    def write(self, chunk: bytes) -> int:
+        with self._condition:
+            self._chunk_starts.append(self.size)
+            self._chunks.append(bytes(chunk))
+            self.size += len(chunk)
+            self._condition.notify_all()
+        return len(chunk)
+
+    def finish(self):
+        with self._condition:
+            self.finished = True
+            self._condition.notify_all()
+
+    def fail(self, error: BaseException):
+        with self._condition:
+            self.error = error
+            self.finished = True
+            self._condition.notify_all()
+
+    def wait_for(self, size: int, timeout: float | None = None) -> bool:
+        # true once at least size bytes are buffered or the download is done
+        with self._condition:
+            ready = self._condition.wait_for(lambda: self.size >= size or self.finished, timeout)
+        if self.error and self.size < size:
+            raise self.error
+        return ready
+
+    def getvalue(self) -> bytes:
+        with self._condition:
+            return b"".join(self._chunks)
+
+    def reader(self) -> "GrowingBufferReader":
+        return GrowingBufferReader(self)
+
+    def _read_at(self, pos: int, size: int, timeout: float | None) -> memoryview | None:
+        # blocks until there is data at pos, returns None on timeout so the caller can report a stall
+        with self._condition:
+            if not self._condition.wait_for(lambda: pos < self.size or self.finished, timeout):
+                return None
+            if pos >= self.size:
+                return memoryview(b"")
+            chunk_index = bisect.bisect_right(self._chunk_starts, pos) - 1
+            chunk = self._chunks[chunk_index]
+            start = self._chunk_starts[chunk_index]
+
+        offset = pos - start
+        return memoryview(chunk)[offset:offset + size]
+
+
+class GrowingBufferReader(io.RawIOBase):
+    STALL_TIMEOUT = 0.5
+
+    def __init__(self, buffer: GrowingBuffer):
+        self._buffer = buffer
+        self._pos = 0
+        self.stalls = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def read(self, size: int = -1) -> memoryview:
+        if size is None or size < 0:
+            self._buffer.wait_for(float("inf"))
+            size = self._buffer.size - self._pos
+
+        stalled = False
+        while (chunk := self._buffer._read_at(self._pos, size, self.STALL_TIMEOUT)) is None:
+            # the download is behind playback, keep waiting instead of ending the song
+            if not stalled:
+                stalled = True
+                self.stalls += 1
+                logger.warning("Playback caught up with the download, waiting for more audio")
+
+        if self._buffer.error and not chunk:
+            logger.error(f"Download failed during playback: {self._buffer.error}")
+
+        self._pos += len(chunk)
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
@@ -1,10 +1,74 @@
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+from contextvars import ContextVar
+import atexit
+import json
 import logging
 import colorlog
 import os
+import queue
 
 os.makedirs("logs", exist_ok=True)
 
+# "text" or "json", json lines carry the guild and command a log came from
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# the log file rolls over at this size and keeps LOG_BACKUPS old files
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# once this many records are waiting to be written only 1 in LOG_DEBUG_SAMPLE debug records are kept, 1 keeps them all
+LOG_DEBUG_SAMPLE = int(os.getenv("LOG_DEBUG_SAMPLE", 10))
+LOG_SAMPLE_BACKLOG = int(os.getenv("LOG_SAMPLE_BACKLOG", 1000))
+
+# set for every slash command, tasks started by the command inherit them
+log_guild: ContextVar[int | None] = ContextVar("log_guild", default=None)
+log_command: ContextVar[str | None] = ContextVar("log_command", default=None)
+
+
+class ContextFilter(logging.Filter):
+    # runs on the thread that logged, the listener thread can't see its context
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "guild_id"):
+            record.guild_id = log_guild.get()
+        if not hasattr(record, "command"):
+            record.command = log_command.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    # drops most debug records while the listener is falling behind
+    def __init__(self, log_queue: queue.Queue, rate: int, backlog: int):
+        super().__init__()
+        self.log_queue = log_queue
+        self.rate = rate
+        self.backlog = backlog
+        self.seen = 0
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 1 or self.log_queue.qsize() < self.backlog:
+            return True
+
+        self.seen += 1
+        if self.seen % self.rate == 0:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            "guild_id": getattr(record, "guild_id", None),
+            "command": getattr(record, "command", None)
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -12,6 +76,9 @@ LOGGING_CONFIG = {
         "verbose": {
             "format": "%(levelname)-10s - %(asctime)s - %(module)-15s : %(message)s"
         },
+        "json": {
+            "()": JsonFormatter
+        },
         "standard": {
             "format": "%(asctime_log_color)s%(asctime)s %(reset)s%(log_color)s%(levelname)-10s %(name)-15s %(message_log_color)s%(message)s",
             "()": "colorlog.ColoredFormatter",
@@ -54,10 +121,12 @@ LOGGING_CONFIG = {
         },
         "file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
-            "filename": "logs/info.log",
-            "mode": "w",
-            "formatter": "verbose"
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.getenv("LOG_FILE", "logs/info.log"),
+            "maxBytes": LOG_MAX_BYTES,
+            "backupCount": LOG_BACKUPS,
+            "encoding": "utf-8",
+            "formatter": "json" if LOG_FORMAT == "json" else "verbose"
         }
     },
     "loggers": {
@@ -68,10 +137,36 @@ LOGGING_CONFIG = {
         },
         "discord": {
             "handlers": ["console2", "file"],
-            "level": "INFO",
+            "level": LOG_LEVEL,
             "propagate": False
         }
     }
 }
 
-dictConfig(LOGGING_CONFIG)
\ No newline at end of file
+dictConfig(LOGGING_CONFIG)
+
+def use_log_queue(name: str) -> QueueListener:
+    # the handlers set up above are moved onto a background thread, logging only puts the record on a queue
+    logger = logging.getLogger(name)
+    handlers = logger.handlers[:]
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue()
+
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(DebugSampler(log_queue, LOG_DEBUG_SAMPLE, LOG_SAMPLE_BACKLOG))
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # write out whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+listeners = [use_log_queue("bot"), use_log_queue("discord")]
+
+def log_context(guild_id: int | None, command: str | None):
+    log_guild.set(guild_id)
+    log_command.set(command)
@@ -1,25 +1,116 @@
+import asyncio
 import discord
 import sqlite3
-from discord.ext import commands
-
-def setup_database() -> sqlite3.Connection:
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    c.execute("CREATE TABLE IF NOT EXISTS music_roles (guild_id INTEGER PRIMARY KEY, role_id INTEGER)")
-    conn.commit()
-    return conn
-
-db_conn = setup_database()
-db_cursor = db_conn.cursor()
-
-def get_music_role(bot: commands.Bot, guild_id: int) -> discord.Role:
-    db_cursor.execute("SELECT role_id FROM music_roles WHERE guild_id = ?", (guild_id,))
-    guild = bot.get_guild(guild_id)
-    role_id = db_cursor.fetchone()
-    if role_id is None:
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import logging
+
+logger = logging.getLogger('discord')
+
+# each entry moves the schema up one version, only append to this list
+MIGRATIONS: list[str] = [
+    # 1
+    "CREATE TABLE IF NOT EXISTS music_roles (guild_id INTEGER PRIMARY KEY, role_id INTEGER)",
+    # 2
+    "CREATE TABLE IF NOT EXISTS loudness (video_id TEXT PRIMARY KEY, integrated REAL, true_peak REAL, gain REAL)",
+    # 3
+    "CREATE TABLE IF NOT EXISTS playback_positions (guild_id INTEGER PRIMARY KEY, channel_id INTEGER, video_id TEXT, position REAL, queue TEXT)",
+    # 4
+    "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+class Database():
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite connections belong to one thread, every query runs on this one
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._conn: sqlite3.Connection | None = None
+
+        # guild_id: role_id, written through to the database
+        self.music_roles: dict[int, int] = {}
+        # video_id: gain in dB, written through to the database
+        self.loudness_gains: dict[str, float] = {}
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def connect(self):
+        if self._conn is None:
+            await self.run(self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        # readers don't wait on the writer, and a commit doesn't wait for a full fsync
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate(conn)
+        self._conn = conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for new_version, statement in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.executescript(statement)
+            conn.execute(f"PRAGMA user_version = {new_version}")
+            conn.commit()
+            logger.info(f"Migrated database to version {new_version}")
+
+    async def load_music_roles(self) -> dict[int, int]:
+        # one query for every guild instead of one per guild
+        rows = await self.run(self._fetchall, "SELECT guild_id, role_id FROM music_roles")
+        self.music_roles = {guild_id: role_id for guild_id, role_id in rows}
+        return self.music_roles
+
+    def get_music_role(self, guild: discord.Guild) -> discord.Role | None:
+        if role_id := self.music_roles.get(guild.id):
+            return guild.get_role(role_id)
         return None
-    return discord.utils.get(guild.roles, id=role_id[0])
 
-def set_music_role(bot: commands.Bot, guild: discord.Guild, role: discord.Role):
-    db_cursor.execute("INSERT OR REPLACE INTO music_roles (guild_id, role_id) VALUES (?, ?)", (guild.id, role.id))
-    db_conn.commit()
\ No newline at end of file
+    async def set_music_role(self, guild: discord.Guild, role: discord.Role):
+        self.music_roles[guild.id] = role.id
+        await self.run(self._execute, "INSERT OR REPLACE INTO music_roles (guild_id, role_id) VALUES (?, ?)", (guild.id, role.id))
+
+    async def load_loudness(self) -> dict[str, float]:
+        rows = await self.run(self._fetchall, "SELECT video_id, gain FROM loudness")
+        self.loudness_gains = {video_id: gain for video_id, gain in rows}
+        return self.loudness_gains
+
+    def get_gain(self, video_id: str) -> float | None:
+        return self.loudness_gains.get(video_id)
+
+    async def set_loudness(self, video_id: str, integrated: float, true_peak: float, gain: float):
+        self.loudness_gains[video_id] = gain
+        await self.run(self._execute, "INSERT OR REPLACE INTO loudness (video_id, integrated, true_peak, gain) VALUES (?, ?, ?, ?)", (video_id, integrated, true_peak, gain))
+
+    async def get_state(self, key: str) -> str | None:
+        rows = await self.run(self._fetchall, "SELECT value FROM bot_state WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    async def set_state(self, key: str, value: str):
+        await self.run(self._execute, "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
+
+    async def load_positions(self) -> list[tuple[int, int, str, float, str]]:
+        return await self.run(self._fetchall, "SELECT guild_id, channel_id, video_id, position, queue FROM playback_positions")
+
+    async def save_positions(self, rows: list[tuple[int, int, str, float, str]], removed: list[int]):
+        await self.run(self._save_positions, rows, removed)
+
+    def _save_positions(self, rows: list[tuple[int, int, str, float, str]], removed: list[int]):
+        # one transaction for every guild, other processes sharing the database keep their own rows
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO playback_positions (guild_id, channel_id, video_id, position, queue) VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("DELETE FROM playback_positions WHERE guild_id = ?", [(guild_id,) for guild_id in removed])
+
+    def _execute(self, query: str, params: tuple = ()):
+        self._conn.execute(query, params)
+        self._conn.commit()
+
+    def _fetchall(self, query: str, params: tuple = ()) -> list[tuple]:
+        return self._conn.execute(query, params).fetchall()
+
+    async def close(self):
+        if self._conn is not None:
+            await self.run(self._conn.close)
+            self._conn = None
+
+db = Database("database.db")
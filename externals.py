@@ -3,4 +3,86 @@ import os
 
 load_dotenv()
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
\ No newline at end of file
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# number of threads used to download and resolve songs off the event loop
+RESOLVER_WORKERS = int(os.getenv("RESOLVER_WORKERS", 4))
+
+# total size of downloaded audio kept in memory, least recently played songs are dropped first
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# downloaded songs are also written here so they survive a restart
+DISK_CACHE_DIR = os.getenv("DISK_CACHE_DIR", "cache/audio")
+DISK_CACHE_MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+
+# start playing songs while they are still downloading once this much audio is buffered
+PROGRESSIVE_PLAYBACK = os.getenv("PROGRESSIVE_PLAYBACK", "true").lower() == "true"
+PROGRESSIVE_START_BYTES = int(os.getenv("PROGRESSIVE_START_BYTES", 256 * 1024))
+
+# prefer opus streams and send their packets to discord without transcoding
+OPUS_PASSTHROUGH = os.getenv("OPUS_PASSTHROUGH", "true").lower() == "true"
+
+# how many queued songs each guild downloads ahead, and how many downloads the prefetcher runs at once across all guilds
+PREFETCH_AHEAD = int(os.getenv("PREFETCH_AHEAD", 2))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", 4))
+
+# number of songs whose title, author, duration and stream info are kept in memory
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 10000))
+
+# search results are cached per query for this many seconds
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 2000))
+# how many results a search returns
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", 5))
+
+# titles of loaded songs, used for /play and /search autocomplete
+TITLE_INDEX_PATH = os.getenv("TITLE_INDEX_PATH", "cache/title_index.json")
+
+# how many playlist songs have their metadata loaded at once, and the most songs one /playlist adds
+PLAYLIST_CONCURRENCY = int(os.getenv("PLAYLIST_CONCURRENCY", 8))
+PLAYLIST_MAX_SONGS = int(os.getenv("PLAYLIST_MAX_SONGS", 500))
+
+def parse_shard_ids(value: str | None) -> list[int] | None:
+    # "0-3" or "0,1,2,3"
+    if not value:
+        return None
+    shard_ids = []
+    for part in value.split(","):
+        start, _, end = part.strip().partition("-")
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
+
+# run as an AutoShardedBot, SHARD_COUNT and SHARD_IDS are set by launcher.py for each cluster process
+SHARDED = os.getenv("SHARDED", "false").lower() == "true"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", 0))
+# number of processes launcher.py started, they split the cores between them
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", 1))
+
+def parse_worker_count(value: str) -> int | None:
+    if value.lower() == "auto":
+        return max(1, (os.cpu_count() or 1) // CLUSTER_COUNT)
+    return int(value) or None
+
+# number of audio worker processes, "auto" for this process's share of the cores and 0 to run ffmpeg inside the bot process
+AUDIO_WORKERS = parse_worker_count(os.getenv("AUDIO_WORKERS", "auto"))
+
+# prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics, 0 turns the endpoint off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# seconds a guild can go without playback or listeners before the bot leaves voice and forgets its queue
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", 300))
+
+# measure each song's loudness once and play it at LOUDNESS_TARGET LUFS
+LOUDNESS_NORMALIZATION = os.getenv("LOUDNESS_NORMALIZATION", "true").lower() == "true"
+LOUDNESS_TARGET = float(os.getenv("LOUDNESS_TARGET", -14))
+# opus songs are only re-encoded to change their volume when the gain is at least this many dB
+LOUDNESS_MIN_GAIN = float(os.getenv("LOUDNESS_MIN_GAIN", 1.5))
+# ffmpeg processes measuring loudness at once
+LOUDNESS_WORKERS = int(os.getenv("LOUDNESS_WORKERS", 1))
+
+# songs in the disk cache are encoded once into memory and every guild playing them shares the packets
+BROADCAST = os.getenv("BROADCAST", "true").lower() == "true"
+BROADCAST_CACHE_MAX_BYTES = int(os.getenv("BROADCAST_CACHE_MAX_BYTES", 256 * 1024 * 1024))
@@ -0,0 +1,86 @@
+# starts the bot as several processes, each one running an AutoShardedBot for
+# its own range of shards. the processes share the disk audio cache and the
+# database but nothing else, a guild's music queue lives in the process that
+# owns its shard
+#
+# usage: python launcher.py
+#   SHARD_COUNT  total shards, asked from discord when not set
+#   CLUSTERS     number of processes, defaults to the number of cores
+#   METRICS_PORT cluster N serves its metrics on METRICS_PORT + N
+
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import externals
+import config
+from config import logging
+
+logger = logging.getLogger('bot')
+
+RESTART_DELAY = 5
+
+def recommended_shard_count() -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {externals.BOT_TOKEN}", "User-Agent": "DiscordBot (music-bot launcher)"}
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+    clusters = max(1, min(clusters, shard_count))
+    per_cluster, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for cluster_id in range(clusters):
+        size = per_cluster + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+def start_cluster(cluster_id: int, shard_ids: list[int], shard_count: int, clusters: int) -> subprocess.Popen:
+    env = os.environ.copy()
+    title_index_root, title_index_extension = os.path.splitext(externals.TITLE_INDEX_PATH)
+    env.update({
+        "SHARDED": "true",
+        "SHARD_COUNT": str(shard_count),
+        "SHARD_IDS": ",".join(map(str, shard_ids)),
+        "CLUSTER_ID": str(cluster_id),
+        "CLUSTER_COUNT": str(clusters),
+        # every process serves its own metrics, they can't all listen on one port
+        "METRICS_PORT": str(externals.METRICS_PORT + cluster_id if externals.METRICS_PORT else 0),
+        # files that are rewritten as a whole get one per process
+        "TITLE_INDEX_PATH": f"{title_index_root}-{cluster_id}{title_index_extension}",
+        "LOG_FILE": f"logs/cluster-{cluster_id}.log"
+    })
+    logger.info(f"Starting cluster {cluster_id} with shards {shard_ids[0]}-{shard_ids[-1]}")
+    return subprocess.Popen([sys.executable, "main.py"], env=env)
+
+def main():
+    shard_count = externals.SHARD_COUNT or recommended_shard_count()
+    clusters = int(os.getenv("CLUSTERS", os.cpu_count() or 1))
+    ranges = shard_ranges(shard_count, clusters)
+    logger.info(f"Running {shard_count} shards in {len(ranges)} clusters")
+
+    processes = {cluster_id: start_cluster(cluster_id, shard_ids, shard_count, len(ranges)) for cluster_id, shard_ids in enumerate(ranges)}
+
+    try:
+        while True:
+            time.sleep(1)
+            for cluster_id, process in processes.items():
+                if (code := process.poll()) is not None:
+                    # only this cluster's guilds are affected, the others keep playing
+                    logger.error(f"Cluster {cluster_id} exited with code {code}, restarting in {RESTART_DELAY}s")
+                    time.sleep(RESTART_DELAY)
+                    processes[cluster_id] = start_cluster(cluster_id, ranges[cluster_id], shard_count, len(ranges))
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# loudness is measured once per song with ffmpeg's loudnorm filter and stored
+# in the database. playback only applies the resulting gain with the volume
+# filter, which costs next to nothing compared to running loudnorm on every play
+import json
+import subprocess
+
+import externals
+
+# gain is limited so peaks stay below this many dBTP
+TRUE_PEAK_LIMIT = -1.0
+# quiet songs are never boosted by more than this
+MAX_BOOST = 12.0
+
+def analyze(path: str) -> tuple[float, float]:
+    # (integrated loudness in LUFS, true peak in dBTP)
+    args = [
+        "ffmpeg", "-hide_banner", "-nostats", "-i", path, "-vn",
+        "-af", f"loudnorm=I={externals.LOUDNESS_TARGET}:TP={TRUE_PEAK_LIMIT}:print_format=json",
+        "-f", "null", "-"
+    ]
+    result = subprocess.run(args, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600)
+    return parse_measurements(result.stderr)
+
+def parse_measurements(output: str) -> tuple[float, float]:
+    # loudnorm prints its measurements as the last json object in ffmpeg's output
+    start, end = output.rfind("{"), output.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("ffmpeg did not print loudness measurements")
+    measurements = json.loads(output[start:end + 1])
+    return float(measurements["input_i"]), float(measurements["input_tp"])
+
+def gain_for(integrated: float, true_peak: float) -> float:
+    if integrated == float("-inf"):
+        # silence
+        return 0.0
+    gain = min(externals.LOUDNESS_TARGET - integrated, TRUE_PEAK_LIMIT - true_peak, MAX_BOOST)
+    return round(gain, 2)
+
+def needs_transcode(gain: float) -> bool:
+    # small differences aren't worth giving up opus passthrough for
+    return abs(gain) >= externals.LOUDNESS_MIN_GAIN
+
+def volume_filter(gain: float) -> str:
+    return f"volume={gain:.2f}dB"
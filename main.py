@@ -1,5 +1,9 @@
+import time
+# the startup report counts from here, before discord and everything else is imported
+startup_began = time.perf_counter()
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import externals
 import asyncio
@@ -7,41 +11,232 @@ import pytubefix
 import io
 import config
 from config import logging
-from queue import Queue
-import threading
+from collections import deque
+import itertools
+import random
 import bot_embeds
 import db_handler
+import resolver
+import cache
+import sources
+import tracks
+import audio_workers
+import broadcast
+import loudness
+import yt_search
+import title_index
+import metrics
+import message_updater
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import os
-
-song_buffer: dict[str, io.BytesIO] = {}
-guild_music_roles: dict[int, discord.Role] = {} # guild_id: discord.Role
+import json
+
+audio_cache = cache.AudioCache(externals.AUDIO_CACHE_MAX_BYTES)
+# clusters share the directory, only the first one scans and prunes it so it is held to one budget
+disk_cache = cache.DiskAudioCache(externals.DISK_CACHE_DIR, externals.DISK_CACHE_MAX_BYTES, owner=externals.CLUSTER_ID == 0)
+metadata_cache = tracks.MetadataCache(externals.METADATA_CACHE_MAX_ENTRIES)
+# loaded in the background while the bot logs in
+titles = title_index.TitleIndex(externals.TITLE_INDEX_PATH)
+# songs that are playing while they download, video_id: buffer
+active_downloads: dict[str, cache.GrowingBuffer] = {}
+audio_pool = audio_workers.AudioWorkerPool(externals.AUDIO_WORKERS) if externals.AUDIO_WORKERS is not None else None
+packet_store = broadcast.PacketStore(externals.BROADCAST_CACHE_MAX_BYTES, audio_pool)
+download_executor = ThreadPoolExecutor(max_workers=externals.RESOLVER_WORKERS, thread_name_prefix="song-download")
 
 logger = logging.getLogger('discord')
 logging.getLogger('discord.voice_state').setLevel(logging.WARNING)
 logging.getLogger('discord.player').setLevel(logging.WARNING)
 
+song_resolve_seconds = metrics.registry.histogram("musicbot_song_resolve_seconds", "Time taken to load a song by where it was loaded from", ("source",))
+song_download_seconds = metrics.registry.histogram("musicbot_song_download_seconds", "Time taken to download a song from youtube", buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+ffmpeg_start_seconds = metrics.registry.histogram("musicbot_ffmpeg_start_seconds", "Time from starting playback to the first audio packet")
+first_audio_seconds = metrics.registry.histogram("musicbot_command_to_first_audio_seconds", "Time from a command starting a session to the first audio packet")
+track_change_seconds = metrics.registry.histogram("musicbot_track_change_seconds", "Time taken to start the next song in the queue")
+command_seconds = metrics.registry.histogram("musicbot_command_seconds", "Time from a slash command being sent to it finishing", ("command",))
+commands_total = metrics.registry.counter("musicbot_commands_total", "Slash commands handled", ("command", "status"))
+
 class Song():
     def __init__(self, youtube_link: str):
-        if youtube_link in song_buffer:
-            self.__song_bytes = song_buffer[youtube_link]
+        start = time.perf_counter()
+        self.__song_bytes: bytes | None = None
+        # set while the song is still downloading in progressive mode
+        self.__buffer: cache.GrowingBuffer | None = None
+        # set when the song is read by ffmpeg straight from the disk cache
+        self.path: str | None = None
+        self.codec: str | None = None
+
+        self.video_id = tracks.canonical_video_id(youtube_link)
+        self.info: tracks.TrackInfo | None = metadata_cache.get(self.video_id)
+
+        if (cached := audio_cache.get(self.video_id)) is not None:
+            self.__song_bytes = cached.data
+            self.codec = cached.codec
+            self.source = "memory"
             logger.info("Loaded song from memory")
+        elif (buffer := active_downloads.get(self.video_id)) is not None:
+            self.__buffer = buffer
+            self.codec = buffer.codec
+            self.source = "download"
+            logger.info("Loaded song from a download in progress")
+        elif (path := disk_cache.get_path(self.video_id)) is not None:
+            self.path = path
+            self.codec = cache.codec_for_path(path)
+            self.source = "disk"
+            logger.info("Loaded song from disk")
         else:
-            yt = pytubefix.YouTube(youtube_link)
-            audio_stream = yt.streams.filter(only_audio=True).first()
-
-            audio_buffer = io.BytesIO()
-
-            audio_stream.stream_to_buffer(audio_buffer)
-            audio_buffer.seek(0)
-
-            self.__song_bytes = audio_buffer
-            song_buffer[youtube_link] = audio_buffer
-            logger.info("Loaded song from remote address")
-
-        self.yt = pytubefix.YouTube(youtube_link)
-
-    def get_bytes(self):
-        return io.BytesIO(self.__song_bytes.getvalue())
+            yt = pytubefix.YouTube(tracks.watch_url(self.video_id))
+            audio_stream = tracks.pick_audio_stream(yt, externals.OPUS_PASSTHROUGH)
+            self.codec = audio_stream.audio_codec
+            self.info = tracks.TrackInfo.from_youtube(self.video_id, yt, audio_stream)
+            metadata_cache.put(self.info)
+            self.source = "remote"
+
+            if externals.PROGRESSIVE_PLAYBACK:
+                self.__buffer = cache.GrowingBuffer(self.codec)
+                active_downloads[self.video_id] = self.__buffer
+                download_executor.submit(Song.download, self.video_id, audio_stream, self.__buffer)
+
+                # playback can start as soon as there is enough audio for ffmpeg to get going
+                self.__buffer.wait_for(externals.PROGRESSIVE_START_BYTES)
+                logger.info("Started song from remote address while downloading")
+            else:
+                audio_buffer = io.BytesIO()
+
+                with song_download_seconds.time():
+                    audio_stream.stream_to_buffer(audio_buffer)
+
+                self.__song_bytes = audio_buffer.getvalue()
+                audio_cache.put(self.video_id, self.__song_bytes, self.codec)
+                disk_cache.put(self.video_id, self.__song_bytes, audio_stream.subtype)
+                request_loudness(self.video_id)
+                logger.info("Loaded song from remote address")
+
+        if self.info is None:
+            # the audio was cached but its metadata was evicted or lost in a restart
+            self.info = Song.fetch_info(self.video_id)
+
+        song_resolve_seconds.observe(time.perf_counter() - start, source=self.source)
+
+    @staticmethod
+    def get_info(youtube_link: str) -> tracks.TrackInfo:
+        # metadata only, the audio is left for the prefetcher
+        video_id = tracks.canonical_video_id(youtube_link)
+        if (info := metadata_cache.get(video_id)) is not None:
+            return info
+        return Song.fetch_info(video_id)
+
+    @staticmethod
+    def fetch_info(video_id: str) -> tracks.TrackInfo:
+        info = tracks.TrackInfo.from_youtube(video_id, pytubefix.YouTube(tracks.watch_url(video_id)))
+        metadata_cache.put(info)
+        return info
+
+    @staticmethod
+    def download(video_id: str, audio_stream: pytubefix.Stream, buffer: cache.GrowingBuffer):
+        # runs on the download executor, nothing reads its future so every failure is logged here
+        try:
+            try:
+                with song_download_seconds.time():
+                    audio_stream.stream_to_buffer(buffer)
+            except Exception as e:
+                logger.error(f"Failed to download {video_id}: {e}")
+                buffer.fail(e)
+                return
+
+            buffer.finish()
+            song_bytes = buffer.getvalue()
+            try:
+                audio_cache.put(video_id, song_bytes, audio_stream.audio_codec)
+                disk_cache.put(video_id, song_bytes, audio_stream.subtype)
+            except Exception as e:
+                logger.error(f"Failed to cache {video_id}: {e}", exc_info=e)
+                return
+
+            logger.info(f"Finished downloading {video_id}")
+            request_loudness(video_id)
+        finally:
+            # only forget the download once the caches can serve it
+            active_downloads.pop(video_id, None)
+
+    def get_bytes(self, start: float = 0.0) -> tuple[cache.SharedBufferReader | cache.GrowingBufferReader, float]:
+        # the reader and how many seconds ffmpeg still has to skip to get to start
+        if self.__song_bytes is None and self.__buffer is not None:
+            if not self.__buffer.finished or self.__buffer.error:
+                return self.__buffer.reader(), start
+            # download finished since this song was made, switch to the cached bytes
+            self.__song_bytes = self.__buffer.getvalue()
+            self.__buffer = None
+
+        if start and (index := disk_cache.get_index(self.video_id)) is not None:
+            # straight to the cluster holding start, ffmpeg only skips the part of it before start
+            offset, cluster_start = index.locate(start)
+            return cache.SplicedBufferReader(self.__song_bytes, index.header_size, offset), start - cluster_start
+        return cache.SharedBufferReader(self.__song_bytes), start
+
+    def is_on_disk(self) -> bool:
+        return self.path is not None
+
+    def is_opus(self) -> bool:
+        return self.codec == "opus"
+
+
+# a queued song that may not be downloaded yet, the prefetcher resolves the
+# entries near the front of the queue in the background
+class QueueEntry():
+    def __init__(self, video_id: str):
+        self.video_id = video_id
+        self.song: Song | None = None
+        self.task: asyncio.Task | None = None
+        # seconds into the song to start playing from, set when resuming after a restart
+        self.start_at = 0.0
+        self.__display_line: str | None = None
+
+    def start_resolving(self, limit: asyncio.Semaphore | None = None) -> asyncio.Task:
+        if self.task is None:
+            self.task = asyncio.create_task(self._resolve(limit))
+            self.task.add_done_callback(self._log_failure)
+        return self.task
+
+    async def _resolve(self, limit: asyncio.Semaphore | None) -> Song:
+        if limit is None:
+            self.song = await song_resolver.resolve(self.video_id)
+        else:
+            async with limit:
+                self.song = await song_resolver.resolve(self.video_id)
+        titles.add(self.song.info)
+        return self.song
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Failed to load song {self.video_id}: {task.exception()}")
+
+    async def get_song(self) -> Song:
+        if self.song:
+            return self.song
+        return await self.start_resolving()
+
+    def is_resolved(self) -> bool:
+        return self.song is not None
+
+    @property
+    def info(self) -> tracks.TrackInfo | None:
+        return self.song.info if self.song else metadata_cache.peek(self.video_id)
+
+    @property
+    def title(self) -> str:
+        info = self.info
+        return info.title if info else tracks.watch_url(self.video_id)
+
+    @property
+    def display_line(self) -> str:
+        # built once the song's metadata is known, /queue renders the same lines every time
+        if self.__display_line is None:
+            info = self.info
+            if info is None:
+                return tracks.watch_url(self.video_id)
+            self.__display_line = bot_embeds.queue_line(info.title, info.author, info.duration)
+        return self.__display_line
 
 
 class GuildMusicQueue():
@@ -50,9 +245,21 @@ class GuildMusicQueue():
         self.voiceClient = voiceClient
         self.defaultChannel = default_channel
 
-        self.queue = Queue()
+        # only touched from the event loop, discord's player thread hands song changes over with start_next
+        self.queue: deque[QueueEntry] = deque()
         self.main_message: discord.WebhookMessage = None
         self.main_message_owner: discord.Member = None
+        # every edit of main_message goes through this so bursts of changes become one edit
+        self.message_updater = message_updater.MessageUpdater()
+        # set while the first song of a session is loading so other commands queue behind it
+        self.starting = False
+        # when the command that started this session ran, cleared once its first audio is sent
+        self.requested_at: float | None = None
+        # monotonic time this guild last had something playing to someone, used by the idle reaper
+        self.last_active = time.monotonic()
+        # what is playing now, the source counts the frames played for the position
+        self.current_song: Song | None = None
+        self.current_source: sources.StallTolerantSource | None = None
 
     async def join_voice_channel(self, channel: discord.VoiceChannel = None) -> bool:
         if self.voiceClient and self.voiceClient.is_connected():
@@ -80,35 +287,100 @@ class GuildMusicQueue():
         if self.voiceClient:
             self.voiceClient.stop()
 
-    def add_song(self, song: Song):
-        self.queue.put(song)
-
-    def get_next_song(self) -> Song | None:
-        if not self.queue.empty():
-            return self.queue.get()
+    def add_song(self, entry: QueueEntry, first: bool = False):
+        # first puts it ahead of songs queued while a session's first song was loading
+        if first:
+            self.queue.appendleft(entry)
+        else:
+            self.queue.append(entry)
+        self.last_active = time.monotonic()
+        self.prefetch()
+
+    def start_queued(self, channel: discord.VoiceChannel):
+        # the first song of a session failed to load, play what other commands queued behind it meanwhile
+        if self.queue and not self.is_playing_song():
+            self.defaultChannel = self.defaultChannel or channel
+            self.start_next()
+
+    def get_next_song(self) -> QueueEntry | None:
+        if self.queue:
+            return self.queue.popleft()
         return None
-    
+
+    def remove(self, index: int) -> QueueEntry:
+        entry = self.queue[index]
+        del self.queue[index]
+        self.prefetch()
+        return entry
+
+    def move(self, index: int, new_index: int):
+        entry = self.queue[index]
+        del self.queue[index]
+        self.queue.insert(new_index, entry)
+        self.prefetch()
+
+    def shuffle(self):
+        entries = list(self.queue)
+        random.shuffle(entries)
+        self.queue = deque(entries)
+        self.prefetch()
+
+    def position(self, entry: QueueEntry) -> int | None:
+        try:
+            return self.queue.index(entry) + 1
+        except ValueError:
+            return None
+
+    def snapshot(self) -> tuple[str, ...]:
+        # copied on the event loop, views can page through it while the queue keeps changing
+        return tuple(entry.display_line for entry in self.queue)
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def prefetch(self):
+        # download the next few songs while the current one plays, shared limit across all guilds
+        for entry in itertools.islice(self.queue, externals.PREFETCH_AHEAD):
+            entry.start_resolving(prefetch_limit)
+
+    def is_busy(self) -> bool:
+        return bool(self.main_message or self.starting or len(self.queue) > 0 or self.is_playing_song())
+
     def start_next(self, error = None):
+        # called from discord's player thread when a song ends
         if error:
             logger.error(f"Error playing song: {error}")
             return
 
-        song = self.get_next_song()
-        if song:
-            logger.info(f"Found next song {song.yt.title}")
-            asyncio.run_coroutine_threadsafe(self.play_song(song), bot.loop)
-            if self.main_message:
-                asyncio.run_coroutine_threadsafe(self.main_message.edit(embed=bot_embeds.now_playing(song.yt.title, song.yt.author)), bot.loop)
-        else:
-            logger.info("No songs left in queue")
-            if self.voiceClient:
-                asyncio.run_coroutine_threadsafe(self.voiceClient.disconnect(), bot.loop)
-            asyncio.run_coroutine_threadsafe(self.play_song(song), bot.loop)
+        asyncio.run_coroutine_threadsafe(self.advance(), bot.loop)
+
+    async def advance(self):
+        start = time.perf_counter()
+        while entry := self.get_next_song():
+            try:
+                song = await entry.get_song()
+            except Exception:
+                # already logged by the entry, move on to the next one
+                continue
+
+            logger.info(f"Found next song {song.info.title}")
+            await self.play_song(song, entry.start_at)
+            track_change_seconds.observe(time.perf_counter() - start)
+            titles.record_play(song.video_id)
+            self.message_updater.update((bot_embeds.now_playing, song.info.title, song.info.author))
+            self.prefetch()
+            return
 
-    
-    async def play_song(self, song: Song):
+        logger.info("No songs left in queue")
+        if self.voiceClient:
+            await self.voiceClient.disconnect()
+        await self.play_song(None)
+
+    async def play_song(self, song: Song, start: float = 0.0):
         if not song:
-            await self.main_message.edit(embed=bot_embeds.song_stopped(), view=None)
+            self.current_song = None
+            self.current_source = None
+            self.message_updater.close((bot_embeds.song_stopped,))
 
             # no songs left so set stuff to None
             self.main_message = None
@@ -116,16 +388,74 @@ class GuildMusicQueue():
             self.defaultChannel = None
             return
         
+        started = time.perf_counter()
         await self.join_voice_channel()
 
-        audio_buffer = song.get_bytes()
-
-        audio_source = discord.FFmpegPCMAudio(
-            audio_buffer,
-            pipe=True
-        )
+        if externals.LOUDNESS_NORMALIZATION and db_handler.db.get_gain(song.video_id) is None:
+            # played at its own volume this time, measured in the background for next time
+            asyncio.create_task(analyze_loudness(song.video_id))
+
+        self.current_song = song
+        self.current_source = sources.StallTolerantSource(self.open_source(song, start), self.voiceClient, lambda: self.first_packet_sent(started), start)
+        self.voiceClient.play(self.current_source, after=self.start_next)
+
+    def open_source(self, song: Song, start: float = 0.0) -> discord.AudioSource:
+        gain = (db_handler.db.get_gain(song.video_id) or 0.0) if externals.LOUDNESS_NORMALIZATION else 0.0
+        disk_path = song.path or (disk_cache.get_path(song.video_id) if audio_pool or externals.BROADCAST else None)
+
+        # encoded once for every guild, this guild only keeps a position in the shared packets
+        if externals.BROADCAST and disk_path and (track := packet_store.open(song.video_id, os.path.abspath(disk_path), gain, song.info.duration)):
+            return broadcast.BroadcastSource(track, start)
+
+        if audio_pool and disk_path:
+            # ffmpeg and packetizing happen in a worker process, this process only sends the packets
+            return audio_pool.open_stream({"path": os.path.abspath(disk_path), "gain": gain, "start": start})
+
+        before_options = None
+        options = []
+        if song.is_on_disk():
+            source, pipe = song.path, False
+            if start:
+                # ffmpeg seeks in the file itself with the cues in the webm
+                before_options = f"-ss {start:.3f}"
+        else:
+            # still downloading or not written to disk, played from memory in this process
+            (source, skip), pipe = song.get_bytes(start), True
+            if skip:
+                options.append(f"-ss {skip:.3f}")
+
+        if externals.OPUS_PASSTHROUGH and song.is_opus() and not loudness.needs_transcode(gain):
+            # the packets from youtube are copied out of the container and sent as they are, ffmpeg can't filter a copied stream
+            return discord.FFmpegOpusAudio(source, pipe=pipe, codec="copy", before_options=before_options, options=" ".join(options) or None)
+
+        if gain:
+            options.append(f"-af {loudness.volume_filter(gain)}")
+        options = " ".join(options) or None
+
+        if song.is_opus():
+            # too loud or quiet to leave alone, ffmpeg re-encodes it with the gain applied
+            return discord.FFmpegOpusAudio(source, pipe=pipe, before_options=before_options, options=options)
+        return discord.FFmpegPCMAudio(source, pipe=pipe, before_options=before_options, options=options)
+
+    def playback_position(self) -> float | None:
+        if self.current_source is None or not self.is_connected():
+            return None
+        return self.current_source.position
+
+    def seek(self, seconds: float) -> bool:
+        if self.current_song is None or self.current_source is None or not self.is_connected():
+            return False
+        # the player thread switches over at its next frame, the song doesn't end and start_next isn't called
+        self.current_source.replace(self.open_source(self.current_song, seconds), seconds)
+        return True
 
-        self.voiceClient.play(audio_source, after=self.start_next)
+    def first_packet_sent(self, started: float):
+        # called from discord's player thread
+        now = time.perf_counter()
+        ffmpeg_start_seconds.observe(now - started)
+        if self.requested_at is not None:
+            first_audio_seconds.observe(now - self.requested_at)
+            self.requested_at = None
 
     def is_playing_song(self) -> bool:
         if self.voiceClient and self.voiceClient.is_connected():
@@ -134,13 +464,118 @@ class GuildMusicQueue():
 
         return False
 
+    def has_listeners(self) -> bool:
+        if self.voiceClient and self.voiceClient.is_connected():
+            return any(not member.bot for member in self.voiceClient.channel.members)
+        return False
+
+    def is_live(self) -> bool:
+        # playing to someone or about to, everything else counts as idle
+        return self.starting or (self.is_playing_song() and self.has_listeners())
+
+    def is_connected(self) -> bool:
+        return bool(self.voiceClient and self.voiceClient.is_connected())
+
+    async def release(self):
+        # leave voice and drop everything this guild holds, the queue object is forgotten after this
+        self.queue.clear()
+        self.current_song = None
+        self.current_source = None
+        self.message_updater.close((bot_embeds.song_stopped,))
+        self.main_message = None
+        self.main_message_owner = None
+        self.defaultChannel = None
+
+        if self.voiceClient:
+            voice_client, self.voiceClient = self.voiceClient, None
+            if voice_client.is_connected():
+                await voice_client.disconnect()
+
+song_resolver: resolver.Resolver[Song] = resolver.Resolver(Song, max_workers=externals.RESOLVER_WORKERS, name="song-resolver")
+info_resolver: resolver.Resolver[tracks.TrackInfo] = resolver.Resolver(Song.get_info, max_workers=externals.RESOLVER_WORKERS, name="info-resolver")
+prefetch_limit = asyncio.Semaphore(externals.PREFETCH_CONCURRENCY)
+youtube_search = yt_search.YouTubeSearcher(yt_search.SearchCache(externals.SEARCH_CACHE_MAX_ENTRIES, externals.SEARCH_CACHE_TTL), max_workers=externals.RESOLVER_WORKERS)
+
+def measure_loudness(video_id: str) -> tuple[float, float] | None:
+    # measured from the disk cache, None if the song isn't there yet
+    if (path := disk_cache.get_path(video_id)) is None:
+        return None
+    return loudness.analyze(path)
+
+loudness_resolver: resolver.Resolver[tuple[float, float] | None] = resolver.Resolver(measure_loudness, max_workers=externals.LOUDNESS_WORKERS, name="loudness")
+
+async def analyze_loudness(video_id: str):
+    if not externals.LOUDNESS_NORMALIZATION or db_handler.db.get_gain(video_id) is not None:
+        return
+
+    try:
+        measured = await loudness_resolver.resolve(video_id)
+        if measured is None:
+            return
+
+        integrated, true_peak = measured
+        gain = loudness.gain_for(integrated, true_peak)
+        await db_handler.db.set_loudness(video_id, integrated, true_peak, gain)
+    except Exception as e:
+        logger.error(f"Failed to measure the loudness of {video_id}: {e}")
+        return
+    logger.info(f"Measured {video_id} at {integrated} LUFS, playing it with {gain:+.2f}dB")
+
+def request_loudness(video_id: str):
+    # called from download threads once a song is in the disk cache
+    if externals.LOUDNESS_NORMALIZATION:
+        asyncio.run_coroutine_threadsafe(analyze_loudness(video_id), bot.loop)
+
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='/', intents=intents)
+if externals.SHARDED:
+    # every process only holds the music queues of the guilds on its own shards
+    bot = commands.AutoShardedBot(command_prefix='/', intents=intents, shard_count=externals.SHARD_COUNT, shard_ids=externals.SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix='/', intents=intents)
 
 music_queues: dict[int, GuildMusicQueue] = {}
 
+def music_queue_for(guild: discord.Guild, channel: discord.VoiceChannel = None) -> GuildMusicQueue:
+    # only called once a command is allowed to run so rejected commands don't leave state behind
+    if (m_queue := music_queues.get(guild.id)) is None:
+        m_queue = music_queues[guild.id] = GuildMusicQueue(guild, None, channel)
+    return m_queue
+
+def guild_states() -> dict[str, int]:
+    # live guilds are playing to someone, dormant ones are idle and waiting to be reaped
+    live = sum(1 for m_queue in list(music_queues.values()) if m_queue.is_live())
+    return {"live": live, "dormant": len(music_queues) - live}
+
+def command_started_at(interaction: discord.Interaction) -> float:
+    # when the user sent the command, on the perf_counter clock
+    return time.perf_counter() - (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+def cache_stats() -> dict[str, dict[str, float]]:
+    return {
+        "memory": audio_cache.stats(),
+        "disk": disk_cache.stats(),
+        "metadata": metadata_cache.stats(),
+        "broadcast": packet_store.stats(),
+        "search": {"hits": youtube_search.cache.hits, "misses": youtube_search.cache.misses}
+    }
+
+def collect_cache_stat(stat: str) -> dict[tuple[str, ...], float]:
+    return {(name,): stats[stat] for name, stats in cache_stats().items() if stat in stats}
+
+metrics.registry.gauge("musicbot_voice_connections", "Connected voice clients", collect=lambda: len(bot.voice_clients))
+metrics.registry.gauge("musicbot_guild_queues", "Guilds with music queue state", collect=lambda: len(music_queues))
+metrics.registry.gauge("musicbot_guilds", "Guilds with music queue state by whether they are playing to anyone", ("state",), collect=lambda: {(state,): count for state, count in guild_states().items()})
+metrics.registry.gauge("musicbot_queue_depth", "Songs waiting in all queues", collect=lambda: sum(len(m_queue) for m_queue in list(music_queues.values())))
+metrics.registry.gauge("musicbot_resolves_in_flight", "Songs being loaded right now", collect=lambda: song_resolver.in_flight())
+metrics.registry.gauge("musicbot_audio_worker_streams", "Streams running in audio worker processes", collect=lambda: audio_pool.active_streams() if audio_pool else 0)
+metrics.registry.gauge("musicbot_cache_hits", "Cache hits since startup", ("cache",), collect=lambda: collect_cache_stat("hits"))
+metrics.registry.gauge("musicbot_cache_misses", "Cache misses since startup", ("cache",), collect=lambda: collect_cache_stat("misses"))
+metrics.registry.gauge("musicbot_cache_evictions", "Cache evictions since startup", ("cache",), collect=lambda: collect_cache_stat("evictions"))
+metrics.registry.gauge("musicbot_cache_bytes", "Bytes held by the audio caches", ("cache",), collect=lambda: collect_cache_stat("bytes"))
+metrics.registry.gauge("musicbot_shard_latency_seconds", "Gateway latency of every shard", ("shard",), collect=lambda: {(str(shard_id),): latency for shard_id, latency in shard_latencies()})
+
 class MusicView(discord.ui.View):
     def __init__(self, music_queue: GuildMusicQueue, view_owner: discord.Member):
         super().__init__(timeout=None)
@@ -167,7 +602,7 @@ class MusicView(discord.ui.View):
             await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
             return
         
-        songs = self.m_queue.queue.qsize()
+        songs = len(self.m_queue)
 
         self.m_queue.skip()
 
@@ -187,8 +622,7 @@ class MusicView(discord.ui.View):
             asyncio.create_task(self.m_queue.voiceClient.disconnect())
             self.m_queue.voiceClient.stop()
 
-        if self.m_queue.main_message:
-            await self.m_queue.main_message.edit(embed=bot_embeds.song_stopped(), view=None)
+        self.m_queue.message_updater.close((bot_embeds.song_stopped,))
         await interaction.response.send_message(embed=bot_embeds.song_stopped(), ephemeral=True)
         self.m_queue.main_message = None
         self.m_queue.main_message_owner = None
@@ -225,6 +659,40 @@ class MusicView(discord.ui.View):
         await interaction.response.send_message(embed=bot_embeds.resumed(), ephemeral=True)
 
 
+class QueueView(discord.ui.View):
+    PAGE_SIZE = 10
+
+    def __init__(self, lines: tuple[str, ...]):
+        super().__init__(timeout=180)
+        self.lines = lines
+        self.page = 0
+        self.pages = max(1, -(-len(lines) // self.PAGE_SIZE))
+        self.update_buttons()
+
+    def state(self) -> message_updater.State:
+        start = self.page * self.PAGE_SIZE
+        return (bot_embeds.queue_page, self.lines[start:start + self.PAGE_SIZE], start, len(self.lines), self.page, self.pages)
+
+    def render(self) -> discord.Embed:
+        return message_updater.render(self.state())
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    @discord.ui.button(label="◀️ Previous", style=discord.ButtonStyle.gray)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Next ▶️", style=discord.ButtonStyle.gray)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+
 async def can_use_command(member: discord.Member):
     if member.guild_permissions.administrator or member.guild_permissions.manage_guild:
         return True
@@ -235,7 +703,7 @@ async def can_use_command(member: discord.Member):
                 return True
             return False
 
-    if role := guild_music_roles.get(member.guild.id):
+    if role := db_handler.db.get_music_role(member.guild):
         if role in member.roles:
             return True
 
@@ -246,25 +714,297 @@ async def on_command_error(ctx, error):
     if isinstance(error, commands.errors.CommandNotFound):
         return
 
+@tasks.loop(seconds=60)
+async def save_title_index():
+    await bot.loop.run_in_executor(None, titles.save)
+
+def shard_latencies() -> list[tuple[int, float]]:
+    if isinstance(bot, commands.AutoShardedBot):
+        return bot.latencies
+    return [(0, bot.latency)]
+
+@tasks.loop(seconds=30)
+async def reap_idle_guilds():
+    now = time.monotonic()
+    reaped = 0
+    for guild_id, m_queue in list(music_queues.items()):
+        if m_queue.is_live():
+            m_queue.last_active = now
+            continue
+
+        if now - m_queue.last_active < externals.IDLE_TIMEOUT:
+            continue
+
+        del music_queues[guild_id]
+        reaped += 1
+        try:
+            await m_queue.release()
+        except Exception as e:
+            logger.error(f"Failed to release idle guild {m_queue.guild.name}: {e}")
+
+    if reaped:
+        states = guild_states()
+        logger.info(f"Reaped {reaped} idle guilds, {states['live']} live and {states['dormant']} dormant left")
+
+@tasks.loop(minutes=5)
+async def rescan_disk_cache():
+    # the owner counts songs other clusters added and sees their plays in the access times before pruning
+    await asyncio.get_running_loop().run_in_executor(None, disk_cache.scan)
+
+# guilds whose position is in the database, dropped from it once they stop playing
+saved_positions: set[int] = set()
+
+@tasks.loop(seconds=10)
+async def save_playback_positions():
+    rows = []
+    for guild_id, m_queue in list(music_queues.items()):
+        position = m_queue.playback_position()
+        if position is None or m_queue.current_song is None:
+            continue
+        queued = json.dumps([entry.video_id for entry in itertools.islice(m_queue.queue, externals.PLAYLIST_MAX_SONGS)])
+        rows.append((guild_id, m_queue.voiceClient.channel.id, m_queue.current_song.video_id, position, queued))
+
+    playing = {row[0] for row in rows}
+    removed = list(saved_positions - playing)
+    if not rows and not removed:
+        return
+
+    try:
+        await db_handler.db.save_positions(rows, removed)
+    except Exception as e:
+        logger.error(f"Failed to save playback positions: {e}")
+        return
+    saved_positions.clear()
+    saved_positions.update(playing)
+
+def owns_guild(guild_id: int) -> bool:
+    # clusters share the database, a guild on another cluster's shards isn't this process's to clean up
+    if not externals.SHARDED:
+        return True
+    return (guild_id >> 22) % bot.shard_count in (bot.shard_ids or range(bot.shard_count))
+
+async def resume_saved_playback():
+    # picks every guild that was playing when the bot went down back up where it was
+    resumed = 0
+    for guild_id, channel_id, video_id, position, queued in await db_handler.db.load_positions():
+        guild = bot.get_guild(guild_id)
+        channel = guild.get_channel(channel_id) if guild else None
+        if channel is None or guild_id in music_queues:
+            if owns_guild(guild_id):
+                # the next save drops its row unless the guild is playing again by then
+                saved_positions.add(guild_id)
+            continue
+
+        m_queue = music_queue_for(guild, channel)
+        entry = QueueEntry(video_id)
+        entry.start_at = position
+        m_queue.add_song(entry)
+        for queued_id in json.loads(queued):
+            m_queue.add_song(QueueEntry(queued_id))
+        m_queue.start_next()
+        saved_positions.add(guild_id)
+        resumed += 1
+
+    if resumed:
+        logger.info(f"Resumed playback in {resumed} guilds")
+
+@tasks.loop(minutes=5)
+async def log_shard_health():
+    guild_counts: dict[int, int] = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+
+    for shard_id, latency in shard_latencies():
+        logger.info(f"Cluster {externals.CLUSTER_ID} shard {shard_id}: {latency * 1000:.0f}ms latency, {guild_counts.get(shard_id, 0)} guilds")
+
+    states = guild_states()
+    logger.info(f"Cluster {externals.CLUSTER_ID} music queues: {states['live']} live, {states['dormant']} dormant")
+
 @bot.event
-async def on_ready():
-    logger.info("Bot is online")
+async def on_shard_ready(shard_id: int):
+    logger.info(f"Shard {shard_id} is ready")
+
+@bot.event
+async def on_shard_disconnect(shard_id: int):
+    logger.warning(f"Shard {shard_id} disconnected")
+
+@bot.event
+async def on_shard_resumed(shard_id: int):
+    logger.info(f"Shard {shard_id} resumed")
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command: app_commands.Command):
+    commands_total.inc(command=command.qualified_name, status="ok")
+    command_seconds.observe((discord.utils.utcnow() - interaction.created_at).total_seconds(), command=command.qualified_name)
+
+async def tag_command_logs(interaction: discord.Interaction) -> bool:
+    # runs in the task that handles the command, every log from it carries the guild and command
+    config.log_context(interaction.guild_id, interaction.command.qualified_name if interaction.command else None)
+    return True
+
+bot.tree.interaction_check = tag_command_logs
+
+@bot.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    name = interaction.command.qualified_name if interaction.command else "unknown"
+    commands_total.inc(command=name, status="error")
+    logger.error(f"Error in /{name}: {error}", exc_info=error)
+
+metrics_server = None
+# seconds every startup phase took, logged once the bot is ready
+startup_times: dict[str, float] = {}
+
+async def timed(phase: str, coro):
+    # a failing phase is logged and startup carries on, the background loops still have to start
+    start = time.perf_counter()
+    try:
+        return await coro
+    except Exception as e:
+        logger.error(f"Startup phase {phase} failed: {e}", exc_info=e)
+    finally:
+        startup_times[phase] = time.perf_counter() - start
+
+def command_tree_hash() -> str:
+    # the payload a sync would upload, if it hasn't changed discord already has these commands
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda command: command["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_command_tree():
+    key = f"command_tree_hash:{bot.application_id}"
+    tree_hash = command_tree_hash()
+    if await db_handler.db.get_state(key) == tree_hash:
+        logger.info("Commands are unchanged, not syncing them")
+        return
+
     try:
         await bot.tree.sync()
     except Exception as e:
-        print(e)
-        pass
+        logger.error(f"Failed to sync commands: {e}")
+        return
+    await db_handler.db.set_state(key, tree_hash)
+    logger.info(f"Synced {len(bot.tree.get_commands())} commands")
+
+async def load_music_roles():
+    roles = await db_handler.db.load_music_roles()
+    logger.info(f"Loaded music roles for {len(roles)} guilds")
+
+async def load_loudness():
+    gains = await db_handler.db.load_loudness()
+    logger.info(f"Loaded loudness measurements for {len(gains)} songs")
+
+async def start_metrics_server():
+    global metrics_server
+    if externals.METRICS_PORT:
+        metrics_server = await metrics.start_server(externals.METRICS_HOST, externals.METRICS_PORT)
+
+async def start_up(logged_in: float):
+    # runs once per process while the gateway connects, on_ready fires again on every reconnect
+    await timed("database", db_handler.db.connect())
+    await asyncio.gather(
+        timed("command sync", sync_command_tree()),
+        timed("music roles", load_music_roles()),
+        timed("loudness", load_loudness()),
+        timed("title index", asyncio.get_running_loop().run_in_executor(None, titles.load)),
+        timed("metrics server", start_metrics_server())
+    )
+    startup_times["cache warmup"] = time.perf_counter() - logged_in
+
+    save_title_index.start()
+    log_shard_health.start()
+    reap_idle_guilds.start()
+    if disk_cache.owner:
+        rescan_disk_cache.start()
+
+    await bot.wait_until_ready()
+    startup_times["gateway"] = time.perf_counter() - logged_in
+    await timed("resume playback", resume_saved_playback())
+    save_playback_positions.start()
+
+    report = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_times.items())
+    logger.info(f"Started in {time.perf_counter() - startup_began:.2f}s: {report}")
+
+async def setup_hook():
+    # discord.py calls this once after logging in, before connecting to the gateway
+    startup_times["login"] = time.perf_counter() - login_began
+    task = asyncio.create_task(start_up(time.perf_counter()))
+    task.add_done_callback(lambda task: task.cancelled() or not task.exception() or logger.error(f"Startup failed: {task.exception()}", exc_info=task.exception()))
+
+bot.setup_hook = setup_hook
+login_began = startup_began
 
-    for guild in bot.guilds:
-        guild_music_roles[guild.id] = db_handler.get_music_role(bot, guild.id)
+@bot.event
+async def on_ready():
+    logger.info("Bot is online")
+
+async def announce_queued(m_queue: GuildMusicQueue, entry: QueueEntry):
+    try:
+        song = await entry.get_song()
+    except Exception:
+        return
+
+    if m_queue.main_message and (q_pos := m_queue.position(entry)):
+        m_queue.message_updater.update((bot_embeds.add_song, song.info.title, song.info.author, q_pos))
+
+async def send_ephemeral(interaction: discord.Interaction, embed: discord.Embed):
+    # /play hasn't responded yet, /search deferred ephemerally before searching
+    if interaction.response.is_done():
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    else:
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+async def enqueue_song(interaction: discord.Interaction, m_queue: GuildMusicQueue, youtube_link: str, channel: discord.VoiceChannel):
+    try:
+        video_id = tracks.canonical_video_id(youtube_link)
+    except ValueError:
+        await send_ephemeral(interaction, bot_embeds.song_load_failed())
+        return
+
+    entry = QueueEntry(video_id)
+
+    if m_queue.is_busy():
+        # the prefetcher downloads it in the background, the main message is updated once it has a title
+        m_queue.add_song(entry)
+        asyncio.create_task(announce_queued(m_queue, entry))
+        await send_ephemeral(interaction, bot_embeds.song_added())
+        return
+
+    # the first song of a session is loaded before replying with the now playing message, which everyone sees
+    deferred_ephemeral = interaction.response.is_done()
+    m_queue.starting = True
+    try:
+        if not deferred_ephemeral:
+            await interaction.response.defer()
+        song = await entry.get_song()
+    except Exception:
+        m_queue.start_queued(channel)
+        if not deferred_ephemeral:
+            # the error would take the place of the public deferred response, remove it so only the user sees the error
+            await interaction.delete_original_response()
+        await interaction.followup.send(embed=bot_embeds.song_load_failed(), ephemeral=True)
+        return
+    finally:
+        m_queue.starting = False
+
+    m_queue.add_song(entry, first=True)
+    m_queue.defaultChannel = m_queue.defaultChannel or channel
+    m_queue.requested_at = command_started_at(interaction)
+
+    m_queue.start_next()
+
+    state = (bot_embeds.now_playing, song.info.title, song.info.author)
+    if deferred_ephemeral:
+        # a followup would take the place of the ephemeral response, remove it so the now playing message is public
+        await interaction.delete_original_response()
+    m_queue.main_message = await interaction.followup.send(embed=message_updater.render(state), view=MusicView(m_queue, interaction.user))
+    m_queue.message_updater.attach(m_queue.main_message, state)
 
 @bot.tree.command(name="play", description="Play a youtube video")
 async def play(interaction: discord.Interaction, video: str, channel: discord.VoiceChannel = None):
-    m_queue = music_queues.setdefault(interaction.guild.id, GuildMusicQueue(interaction.guild, None, channel))
-
     if not await can_use_command(interaction.user):
         await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
         return
+
+    m_queue = music_queue_for(interaction.guild, channel)
     
     if not channel and not m_queue.defaultChannel and not interaction.user.voice and not interaction.user.voice.channel:
         await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
@@ -272,42 +1012,16 @@ async def play(interaction: discord.Interaction, video: str, channel: discord.Vo
 
     channel = m_queue.defaultChannel or channel or interaction.user.voice.channel
 
-    if m_queue.queue.qsize() < 1 and not m_queue.is_playing_song():
-        song = Song(video)
-        m_queue.add_song(song)
-    else:
-        song = Song(video)
-        m_queue.add_song(song)
-        q_pos = m_queue.queue.qsize()
-        await m_queue.main_message.edit(embed=bot_embeds.add_song(song.yt.title, song.yt.author, q_pos))
-        await interaction.response.send_message(embed=bot_embeds.song_added(), ephemeral=True)
-        return
-    await interaction.response.defer()
-
-    m_queue.defaultChannel = m_queue.defaultChannel or channel
-
-    play_thread = threading.Thread(target=m_queue.start_next)
-    play_thread.start()
-    
-    m_queue.main_message = await interaction.followup.send(embed=bot_embeds.now_playing(song.yt.title, song.yt.author), view=MusicView(m_queue, interaction.user))
+    await enqueue_song(interaction, m_queue, video, channel)
 
 # use pytubefix Search to find videos and play the first one
 @bot.tree.command(name="search", description="Search youtube for a video to play")
 async def search(interaction: discord.Interaction, query: str, channel: discord.VoiceChannel = None):
-    m_queue = music_queues.setdefault(interaction.guild.id, GuildMusicQueue(interaction.guild, None, channel))
-
     if not await can_use_command(interaction.user):
         await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
         return
 
-    # search
-    search_results = pytubefix.Search(query)
-    if not search_results:
-        await interaction.response.send_message(embed=bot_embeds.no_search_results(), ephemeral=True)
-        return
-    
-    # get first result
-    video = search_results.videos[0]
+    m_queue = music_queue_for(interaction.guild, channel)
 
     if not channel and not m_queue.defaultChannel and not interaction.user.voice and not interaction.user.voice.channel:
         await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
@@ -315,23 +1029,153 @@ async def search(interaction: discord.Interaction, query: str, channel: discord.
     
     channel = m_queue.defaultChannel or channel or interaction.user.voice.channel
 
-    song = Song(video.watch_url)
-    m_queue.add_song(song)
+    # ephemeral like the replies it ends in, except the now playing message which enqueue_song sends publicly
+    await interaction.response.defer(ephemeral=True)
 
-    if m_queue.queue.qsize() > 1 or m_queue.is_playing_song():
-        q_pos = m_queue.queue.qsize()
-        await m_queue.main_message.edit(embed=bot_embeds.add_song(song.yt.title, song.yt.author, q_pos))
-        await interaction.response.send_message(embed=bot_embeds.song_added(), ephemeral=True)
+    # search
+    try:
+        results = await youtube_search.search(query, externals.SEARCH_RESULTS)
+    except Exception as e:
+        logger.error(f"Search for '{query}' failed: {e}")
+        results = []
+
+    if not results:
+        await interaction.followup.send(embed=bot_embeds.no_search_results(), ephemeral=True)
+        return
+
+    for result in results:
+        # search results have no stream info, don't replace a full record with them
+        if metadata_cache.peek(result.video_id) is None:
+            metadata_cache.put(result)
+
+    # get first result
+    video = results[0]
+
+    await enqueue_song(interaction, m_queue, video.video_id, channel)
+
+# autocomplete only looks at songs the bot has already loaded, it never searches youtube
+@play.autocomplete("video")
+async def video_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    return [
+        app_commands.Choice(name=title[:100], value=tracks.watch_url(video_id))
+        for video_id, title in titles.lookup(current)
+    ]
+
+@search.autocomplete("query")
+async def query_autocomplete(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    return [
+        app_commands.Choice(name=title[:100], value=title[:100])
+        for _, title in titles.lookup(current)
+    ]
+
+def enumerate_playlist(playlist_url: str, loop: asyncio.AbstractEventLoop, video_urls: asyncio.Queue):
+    # runs on a thread, pytubefix fetches the playlist a page at a time as it is iterated
+    try:
+        playlist = pytubefix.Playlist(playlist_url)
+        for i, video_url in enumerate(playlist.video_urls):
+            if i >= externals.PLAYLIST_MAX_SONGS:
+                break
+            loop.call_soon_threadsafe(video_urls.put_nowait, video_url)
+    except Exception as e:
+        logger.error(f"Failed to read playlist {playlist_url}: {e}")
+    finally:
+        loop.call_soon_threadsafe(video_urls.put_nowait, None)
+
+async def import_playlist(interaction: discord.Interaction, m_queue: GuildMusicQueue, playlist_url: str, channel: discord.VoiceChannel):
+    loop = asyncio.get_running_loop()
+    video_urls: asyncio.Queue[str | None] = asyncio.Queue()
+    loop.run_in_executor(None, enumerate_playlist, playlist_url, loop, video_urls)
+
+    progress = await interaction.followup.send(embed=bot_embeds.playlist_progress(0, 0, 0, False), wait=True)
+
+    start_playing = not m_queue.is_busy()
+    if start_playing:
+        m_queue.starting = True
+
+    fan_out = asyncio.Semaphore(externals.PLAYLIST_CONCURRENCY)
+    # metadata resolves out of order, entries are queued in playlist order as soon as everything before them is done
+    resolved: dict[int, tracks.TrackInfo | None] = {}
+    next_index = 0
+    added = failed = 0
+    last_progress = loop.time()
+
+    async def resolve_info(index: int, video_url: str):
+        async with fan_out:
+            try:
+                resolved[index] = await info_resolver.resolve(video_url)
+            except Exception as e:
+                logger.error(f"Failed to load playlist song {video_url}: {e}")
+                resolved[index] = None
+
+    async def flush():
+        nonlocal next_index, added, failed, start_playing
+        while next_index in resolved:
+            info = resolved.pop(next_index)
+            next_index += 1
+            if info is None:
+                failed += 1
+                continue
+
+            titles.add(info)
+            m_queue.add_song(QueueEntry(info.video_id), first=start_playing)
+            added += 1
+
+            if start_playing:
+                start_playing = False
+                m_queue.starting = False
+                m_queue.defaultChannel = m_queue.defaultChannel or channel
+                m_queue.requested_at = command_started_at(interaction)
+                m_queue.start_next()
+                state = (bot_embeds.now_playing, info.title, info.author)
+                m_queue.main_message = await interaction.followup.send(embed=message_updater.render(state), view=MusicView(m_queue, interaction.user), wait=True)
+                m_queue.message_updater.attach(m_queue.main_message, state)
+
+    pending: set[asyncio.Task] = set()
+    total = 0
+    try:
+        while (video_url := await video_urls.get()) is not None:
+            task = asyncio.create_task(resolve_info(total, video_url))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            total += 1
+
+            await flush()
+            if loop.time() - last_progress > 2:
+                last_progress = loop.time()
+                await progress.edit(embed=bot_embeds.playlist_progress(added, failed, total, False))
+
+        for task in asyncio.as_completed(list(pending)):
+            await task
+            await flush()
+            if loop.time() - last_progress > 2:
+                last_progress = loop.time()
+                await progress.edit(embed=bot_embeds.playlist_progress(added, failed, total, False))
+        # songs whose metadata came in after the last flush of the loops above, with nothing left pending to flush them
+        await flush()
+    finally:
+        if start_playing:
+            # nothing in the playlist could be loaded
+            m_queue.starting = False
+            m_queue.start_queued(channel)
+
+    await progress.edit(embed=bot_embeds.playlist_progress(added, failed, total, True))
+
+@bot.tree.command(name="playlist", description="Add every video in a youtube playlist to the queue")
+async def playlist(interaction: discord.Interaction, url: str, channel: discord.VoiceChannel = None):
+    if not await can_use_command(interaction.user):
+        await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
         return
-    
-    await interaction.response.defer()
 
-    m_queue.defaultChannel = channel
+    m_queue = music_queue_for(interaction.guild, channel)
 
-    play_thread = threading.Thread(target=m_queue.start_next)
-    play_thread.start()
+    if not channel and not m_queue.defaultChannel and not interaction.user.voice and not interaction.user.voice.channel:
+        await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
+        return
 
-    m_queue.main_message = await interaction.followup.send(embed=bot_embeds.now_playing(song.yt.title, song.yt.author), view=MusicView(m_queue, interaction.user))
+    channel = m_queue.defaultChannel or channel or interaction.user.voice.channel
+
+    await interaction.response.defer()
+    await import_playlist(interaction, m_queue, url, channel)
 
 @bot.tree.command(name="skip", description="Skip the current song")
 async def skip(interaction: discord.Interaction):
@@ -344,7 +1188,7 @@ async def skip(interaction: discord.Interaction):
         await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
         return
 
-    songs = m_queue.queue.qsize()
+    songs = len(m_queue)
 
     m_queue.skip()
     await interaction.response.send_message(embed=bot_embeds.skipped_song(songs - 1))
@@ -366,7 +1210,7 @@ async def stop(interaction: discord.Interaction):
         m_queue.voiceClient.stop()
 
     if m_queue.main_message:
-            await m_queue.main_message.edit(embed=bot_embeds.song_stopped(), view=None)
+            m_queue.message_updater.close((bot_embeds.song_stopped,))
             m_queue.main_message = None
             m_queue.main_message_owner = None
             m_queue.defaultChannel = None
@@ -379,21 +1223,120 @@ async def queue(interaction: discord.Interaction):
         return
     m_queue = music_queues[interaction.guild.id]
 
-    if m_queue.queue.qsize() < 1:
+    if len(m_queue) < 1:
         await interaction.response.send_message(embed=bot_embeds.no_songs_queue(), ephemeral=True)
         return
 
-    r_embed = discord.Embed(color=0xffeb00, title=f"Queue ({m_queue.queue.qsize()} Songs)")
-    r_embed.description = '**Next song will be played after the current one finishes**'
-    item: Song
-    for i, item in enumerate(list(m_queue.queue.queue)):
-        r_embed.description += f"```{i + 1}. {item.yt.title}```"
+    view = QueueView(m_queue.snapshot())
 
     if m_queue.main_message and m_queue.main_message_owner.id == interaction.user.id:
-        await m_queue.main_message.edit(embed=r_embed)
-        await interaction.response.send_message(embed=bot_embeds.queue_updated(), ephemeral=True)
-    else:
-        await interaction.response.send_message(embed=r_embed, ephemeral=True)
+        m_queue.message_updater.update(view.state())
+    await interaction.response.send_message(embed=view.render(), view=view if view.pages > 1 else discord.utils.MISSING, ephemeral=True)
+
+@bot.tree.command(name="remove", description="Remove a song from the queue")
+async def remove(interaction: discord.Interaction, position: app_commands.Range[int, 1]):
+    m_queue = music_queues.get(interaction.guild.id)
+    if not m_queue or len(m_queue) < 1:
+        await interaction.response.send_message(embed=bot_embeds.no_songs_queue(), ephemeral=True)
+        return
+
+    if not await can_use_command(interaction.user):
+        await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
+        return
+
+    if position > len(m_queue):
+        await interaction.response.send_message(embed=bot_embeds.invalid_position(len(m_queue)), ephemeral=True)
+        return
+
+    entry = m_queue.remove(position - 1)
+    await interaction.response.send_message(embed=bot_embeds.song_removed(entry.title), ephemeral=True)
+
+@bot.tree.command(name="move", description="Move a song to a different position in the queue")
+async def move(interaction: discord.Interaction, position: app_commands.Range[int, 1], new_position: app_commands.Range[int, 1]):
+    m_queue = music_queues.get(interaction.guild.id)
+    if not m_queue or len(m_queue) < 1:
+        await interaction.response.send_message(embed=bot_embeds.no_songs_queue(), ephemeral=True)
+        return
+
+    if not await can_use_command(interaction.user):
+        await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
+        return
+
+    if position > len(m_queue) or new_position > len(m_queue):
+        await interaction.response.send_message(embed=bot_embeds.invalid_position(len(m_queue)), ephemeral=True)
+        return
+
+    m_queue.move(position - 1, new_position - 1)
+    await interaction.response.send_message(embed=bot_embeds.queue_updated(), ephemeral=True)
+
+@bot.tree.command(name="shuffle", description="Shuffle the song queue")
+async def shuffle(interaction: discord.Interaction):
+    m_queue = music_queues.get(interaction.guild.id)
+    if not m_queue or len(m_queue) < 1:
+        await interaction.response.send_message(embed=bot_embeds.no_songs_queue(), ephemeral=True)
+        return
+
+    if not await can_use_command(interaction.user):
+        await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
+        return
+
+    m_queue.shuffle()
+    await interaction.response.send_message(embed=bot_embeds.queue_updated(), ephemeral=True)
+
+@bot.tree.command(name="seek", description="Jump to a time in the current song")
+async def seek(interaction: discord.Interaction, timestamp: str):
+    m_queue = music_queues.get(interaction.guild.id)
+    if not m_queue or not m_queue.current_song or not m_queue.is_connected():
+        await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
+        return
+
+    if not await can_use_command(interaction.user):
+        await interaction.response.send_message(embed=bot_embeds.not_view_owner(), ephemeral=True)
+        return
+
+    song = m_queue.current_song
+    duration = song.info.duration
+    # "1:30" or "90"
+    parts = timestamp.strip().split(":")
+    position = yt_search.parse_duration(timestamp.strip())
+    if not all(part.isdigit() for part in parts) or (duration and position >= duration):
+        await interaction.response.send_message(embed=bot_embeds.invalid_seek(duration), ephemeral=True)
+        return
+
+    if not m_queue.seek(position):
+        await interaction.response.send_message(embed=bot_embeds.no_song(), ephemeral=True)
+        return
+    await interaction.response.send_message(embed=bot_embeds.seeked(song.info.title, position))
+
+@bot.tree.command(name="shards", description="Show the latency of every shard in this process")
+async def shards(interaction: discord.Interaction):
+    guild_counts: dict[int, int] = {}
+    for guild in bot.guilds:
+        guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+
+    shard_info = [(shard_id, latency, guild_counts.get(shard_id, 0)) for shard_id, latency in shard_latencies()]
+    await interaction.response.send_message(embed=bot_embeds.shard_status(externals.CLUSTER_ID, interaction.guild.shard_id, shard_info), ephemeral=True)
+
+@bot.tree.command(name="stats", description="Show performance statistics for the bot")
+async def stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message(embed=bot_embeds.not_admin(), ephemeral=True)
+        return
+
+    latencies = {
+        "Command": (command_seconds.quantile(0.5, command="play"), command_seconds.quantile(0.95, command="play")),
+        "Song load": (song_resolve_seconds.quantile(0.5, source="remote"), song_resolve_seconds.quantile(0.95, source="remote")),
+        "FFmpeg start": (ffmpeg_start_seconds.quantile(0.5), ffmpeg_start_seconds.quantile(0.95)),
+        "Command to audio": (first_audio_seconds.quantile(0.5), first_audio_seconds.quantile(0.95))
+    }
+    activity = {
+        "Voice connections": len(bot.voice_clients),
+        "Guild queues": len(music_queues),
+        "Live guilds": guild_states()["live"],
+        "Queued songs": sum(len(m_queue) for m_queue in music_queues.values()),
+        "Audio worker streams": audio_pool.active_streams() if audio_pool else 0
+    }
+    await interaction.response.send_message(embed=bot_embeds.stats(activity, latencies, cache_stats()), ephemeral=True)
 
 @bot.tree.command(name="musicrole", description="Set a role that can control the music bot")
 async def musicrole(interaction: discord.Interaction, role: discord.Role):
@@ -401,16 +1344,21 @@ async def musicrole(interaction: discord.Interaction, role: discord.Role):
         await interaction.response.send_message(embed=bot_embeds.not_admin(), ephemeral=True)
         return
 
-    db_handler.set_music_role(bot, interaction.guild, role)
-    guild_music_roles[interaction.guild.id] = role
+    await db_handler.db.set_music_role(interaction.guild, role)
     await interaction.response.send_message(embed=bot_embeds.music_role_set(role))
 
 @bot.tree.command(name="whatrole", description="Check the current music role")
 async def whatrole(interaction: discord.Interaction):
-    if role := guild_music_roles.get(interaction.guild.id):
+    if role := db_handler.db.get_music_role(interaction.guild):
         await interaction.response.send_message(embed=bot_embeds.music_role_set(role))
     else:
         await interaction.response.send_message(embed=bot_embeds.no_songs_queue(), ephemeral=True)
 
 if __name__ == '__main__':
+    startup_times["imports"] = time.perf_counter() - startup_began
+    if audio_pool:
+        started = time.perf_counter()
+        audio_pool.start()
+        startup_times["audio workers"] = time.perf_counter() - started
+    login_began = time.perf_counter()
     bot.run(externals.BOT_TOKEN)
\ No newline at end of file
@@ -0,0 +1,153 @@
+# keeps a guild's now playing message in sync with its queue without spending
+# the bot's rate limit. updates only record the newest state, one task per
+# message sends it after a short debounce, and nothing is sent when the message
+# already shows that state. discord.py waits out 429s itself and retries, an
+# edit only fails with one when it gave up or the wait was over the client's
+# max_ratelimit_timeout
+import asyncio
+import time
+from typing import Any, Callable
+
+import discord
+
+import metrics
+from config import logging
+
+logger = logging.getLogger('discord')
+
+# how long to wait for more updates before editing
+DEBOUNCE = 0.5
+# discord lets a channel edit a message about 5 times every 5 seconds
+MIN_EDIT_INTERVAL = 1.0
+# used when a 429 that discord.py gave up on doesn't say how long to wait
+DEFAULT_RETRY_AFTER = 5.0
+
+# (embed function, *arguments), rendered with render() only when it is going to be sent
+State = tuple[Callable[..., discord.Embed], ...]
+
+message_edits_total = metrics.registry.counter("musicbot_message_edits_total", "Now playing message updates by what happened to them", ("result",))
+
+def render(state: State) -> discord.Embed:
+    return state[0](*state[1:])
+
+def retry_after(error: discord.HTTPException | discord.RateLimited) -> float:
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    headers = getattr(error.response, "headers", None) or {}
+    for header in ("Retry-After", "X-RateLimit-Reset-After"):
+        try:
+            return float(headers[header])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return DEFAULT_RETRY_AFTER
+
+
+class MessageUpdater():
+    def __init__(self):
+        self.message: discord.Message | None = None
+        # what the message shows right now
+        self._sent: State | None = None
+        self._pending: State | None = None
+        self._pending_view: discord.ui.View | None = discord.utils.MISSING
+        self._task: asyncio.Task | None = None
+        # perf_counter time the next edit is allowed at
+        self._next_edit_at = 0.0
+
+    def attach(self, message: discord.Message, state: State):
+        # a new message was sent showing state, later updates edit this one
+        self._cancel()
+        self.message = message
+        self._sent = state
+
+    def update(self, state: State, view: discord.ui.View | None = discord.utils.MISSING):
+        if self.message is None:
+            return
+
+        if self._pending is not None:
+            message_edits_total.inc(result="coalesced")
+        self._pending = state
+        if view is not discord.utils.MISSING:
+            self._pending_view = view
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush(self.message))
+
+    def close(self, state: State):
+        # last edit of the message, its buttons are removed and it is never edited again
+        message = self.message
+        if message is None:
+            return
+
+        self._cancel()
+        self.message = None
+        self._sent = None
+        asyncio.create_task(self._edit(message, {"embed": render(state), "view": None}, max(self._next_edit_at - time.perf_counter(), 0)))
+
+    def _cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        self._pending = None
+        self._pending_view = discord.utils.MISSING
+
+    async def _flush(self, message: discord.Message):
+        await asyncio.sleep(max(DEBOUNCE, self._next_edit_at - time.perf_counter()))
+
+        while self._pending is not None and self.message is message:
+            state, view = self._pending, self._pending_view
+            self._pending, self._pending_view = None, discord.utils.MISSING
+
+            if state == self._sent and view is discord.utils.MISSING:
+                message_edits_total.inc(result="unchanged")
+                continue
+
+            kwargs: dict[str, Any] = {"embed": render(state)}
+            if view is not discord.utils.MISSING:
+                kwargs["view"] = view
+
+            if not await self._edit(message, kwargs):
+                if self._pending is None:
+                    # try again with this state unless something newer came in
+                    self._pending, self._pending_view = state, view
+                continue
+
+            self._sent = state
+            if self._pending is not None:
+                await asyncio.sleep(max(self._next_edit_at - time.perf_counter(), 0))
+
+    async def _edit(self, message: discord.Message, kwargs: dict[str, Any], delay: float = 0) -> bool:
+        # returns False when the edit should be retried
+        if delay:
+            await asyncio.sleep(delay)
+
+        for _ in range(3):
+            try:
+                await message.edit(**kwargs)
+            except discord.NotFound:
+                # the message was deleted, nothing left to update
+                message_edits_total.inc(result="failed")
+                if self.message is message:
+                    self.message = None
+                return True
+            except (discord.HTTPException, discord.RateLimited) as e:
+                if isinstance(e, discord.HTTPException) and e.status != 429:
+                    logger.error(f"Failed to update the now playing message: {e}")
+                    message_edits_total.inc(result="failed")
+                    return True
+
+                wait = retry_after(e)
+                message_edits_total.inc(result="rate_limited")
+                logger.warning(f"Rate limited editing the now playing message, retrying in {wait:.1f}s")
+                self._next_edit_at = time.perf_counter() + wait
+                if self.message is message:
+                    # the flush loop picks up whatever is newest once the wait is over
+                    await asyncio.sleep(wait)
+                    return False
+                await asyncio.sleep(wait)
+                continue
+
+            message_edits_total.inc(result="sent")
+            self._next_edit_at = time.perf_counter() + MIN_EDIT_INTERVAL
+            return True
+
+        return True
@@ -0,0 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+from config import logging
+
+logger = logging.getLogger('discord')
+
+T = TypeVar("T")
+
+# runs a blocking factory on a bounded thread pool, callers asking for a key
+# that is already being resolved wait on the same future instead
+class Resolver(Generic[T]):
+    def __init__(self, factory: Callable[[str], T], max_workers: int = 4, name: str = "resolver"):
+        self.factory = factory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._pending: dict[str, asyncio.Future] = {}
+
+    async def resolve(self, key: str) -> T:
+        if future := self._pending.get(key):
+            logger.info(f"Joined in-flight resolve for {key}")
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.factory, key)
+        self._pending[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+
+        # shield so one cancelled caller doesn't cancel the download for the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
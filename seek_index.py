@@ -0,0 +1,145 @@
+# maps a time in a cached song to the byte offset of the webm cluster that
+# holds it. built once when the song is downloaded by walking the cluster
+# headers, the audio is never decoded. a seek plays the container header
+# followed by the bytes from that cluster on, so nothing before it is read
+import json
+import os
+import tempfile
+
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+INFO_ID = 0x1549A966
+TIMECODE_SCALE_ID = 0x2AD7B1
+CLUSTER_ID = 0x1F43B675
+TIMECODE_ID = 0xE7
+
+DEFAULT_TIMECODE_SCALE = 1_000_000
+INDEX_VERSION = 1
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool) -> tuple[int, int]:
+    # (value, length) of the ebml variable length integer at pos, -1 for an unknown size
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise ValueError(f"Invalid element at byte {pos}")
+
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return -1, length
+    return value, length
+
+def _read_element(data: bytes, pos: int) -> tuple[int, int, int]:
+    # (id, start of the content, size of the content)
+    element_id, id_length = _read_vint(data, pos, keep_marker=True)
+    size, size_length = _read_vint(data, pos + id_length, keep_marker=False)
+    return element_id, pos + id_length + size_length, size
+
+def _read_uint(data: bytes, start: int, size: int) -> int:
+    return int.from_bytes(data[start:start + size], "big")
+
+
+class SeekIndex():
+    def __init__(self, header_size: int, clusters: list[tuple[int, int]]):
+        # bytes before the first cluster, everything a player needs to start decoding
+        self.header_size = header_size
+        # (start time in ms, byte offset) of every cluster in order
+        self.clusters = clusters
+
+        # cluster index for every whole second, a lookup never has to search
+        self._by_second: list[int] = []
+        cluster = 0
+        for second in range(-(-clusters[-1][0] // 1000) + 1 if clusters else 0):
+            while cluster + 1 < len(clusters) and clusters[cluster + 1][0] <= second * 1000:
+                cluster += 1
+            self._by_second.append(cluster)
+
+    def locate(self, seconds: float) -> tuple[int, float]:
+        # (byte offset, start time) of the last cluster starting at or before seconds
+        if not self._by_second:
+            return self.header_size, 0.0
+        cluster = self._by_second[max(0, min(int(seconds), len(self._by_second) - 1))]
+        time_ms, offset = self.clusters[cluster]
+        return offset, time_ms / 1000
+
+    def duration(self) -> float:
+        return self.clusters[-1][0] / 1000 if self.clusters else 0.0
+
+    def save(self, path: str):
+        directory = os.path.dirname(path) or "."
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump({"version": INDEX_VERSION, "header": self.header_size, "clusters": self.clusters}, file, separators=(",", ":"))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "SeekIndex | None":
+        try:
+            with open(path, "r") as file:
+                loaded = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if loaded.get("version") != INDEX_VERSION:
+            return None
+        return cls(loaded["header"], [(time_ms, offset) for time_ms, offset in loaded["clusters"]])
+
+
+def build_webm_index(data: bytes) -> SeekIndex | None:
+    # None if the file isn't a webm this can index, playback then falls back to ffmpeg's own seeking
+    try:
+        element_id, start, size = _read_element(data, 0)
+        if element_id != EBML_ID:
+            return None
+        pos = start + size
+
+        element_id, segment_start, segment_size = _read_element(data, pos)
+        if element_id != SEGMENT_ID:
+            return None
+        segment_end = len(data) if segment_size == -1 else min(len(data), segment_start + segment_size)
+
+        timecode_scale = DEFAULT_TIMECODE_SCALE
+        header_size = None
+        clusters: list[tuple[int, int]] = []
+
+        pos = segment_start
+        while pos < segment_end:
+            element_id, start, size = _read_element(data, pos)
+
+            if element_id == INFO_ID:
+                child = start
+                while child < start + size:
+                    child_id, child_start, child_size = _read_element(data, child)
+                    if child_id == TIMECODE_SCALE_ID:
+                        timecode_scale = _read_uint(data, child_start, child_size)
+                    child = child_start + child_size
+
+            elif element_id == CLUSTER_ID:
+                if size == -1:
+                    # live recordings don't say how long their clusters are
+                    return None
+                if header_size is None:
+                    header_size = pos
+                child_id, child_start, child_size = _read_element(data, start)
+                if child_id == TIMECODE_ID:
+                    clusters.append((_read_uint(data, child_start, child_size) * timecode_scale // 1_000_000, pos))
+
+            elif size == -1:
+                return None
+
+            pos = start + size
+    except (ValueError, IndexError):
+        return None
+
+    if header_size is None or not clusters:
+        return None
+    return SeekIndex(header_size, clusters)
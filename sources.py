@@ -0,0 +1,69 @@
+import threading
+import time
+from typing import Callable
+
+import discord
+
+# wraps the source given to VoiceClient.play, discord's player catches up on
+# time it thinks it lost by sending frames back to back, so after a read that
+# blocked (a progressive download falling behind) its clock is restarted instead
+class StallTolerantSource(discord.AudioSource):
+    STALL_THRESHOLD = 0.1
+    FRAME_LENGTH = 0.02
+
+    def __init__(self, source: discord.AudioSource, voice_client: discord.VoiceClient, on_first_packet: Callable[[], None] | None = None, start: float = 0.0):
+        self.source = source
+        self.voice_client = voice_client
+        self.on_first_packet = on_first_packet
+        # where in the song the source started, every frame read after that is 20ms of audio
+        self.start = start
+        self.frames = 0
+        # (source, start) to switch to, swapped in by the player thread so it never reads a closed source
+        self._replacement: tuple[discord.AudioSource, float] | None = None
+        self._replacement_lock = threading.Lock()
+
+    @property
+    def position(self) -> float:
+        return self.start + self.frames * self.FRAME_LENGTH
+
+    def replace(self, source: discord.AudioSource, start: float):
+        with self._replacement_lock:
+            previous, self._replacement = self._replacement, (source, start)
+        if previous is not None:
+            previous[0].cleanup()
+
+    def read(self) -> bytes:
+        if self._replacement is not None:
+            with self._replacement_lock:
+                replacement, self._replacement = self._replacement, None
+            if replacement is not None:
+                old = self.source
+                self.source, self.start = replacement
+                self.frames = 0
+                old.cleanup()
+
+        start = time.perf_counter()
+        data = self.source.read()
+
+        if data:
+            self.frames += 1
+
+        if data and self.on_first_packet:
+            self.on_first_packet()
+            self.on_first_packet = None
+
+        if data and time.perf_counter() - start > self.STALL_THRESHOLD and self.voice_client.is_playing():
+            self.voice_client.pause()
+            self.voice_client.resume()
+
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        with self._replacement_lock:
+            replacement, self._replacement = self._replacement, None
+        if replacement is not None:
+            replacement[0].cleanup()
+        self.source.cleanup()
@@ -0,0 +1,119 @@
+import bisect
+import heapq
+import json
+import os
+import tempfile
+import threading
+
+import tracks
+from config import logging
+
+logger = logging.getLogger('discord')
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.lower().split())
+
+
+# prefix index over the titles of songs the bot has resolved, used to answer
+# autocomplete without going to youtube. every word of a title is a key so
+# "never" and "gonna" both find "Never Gonna Give You Up"
+class TitleIndex():
+    def __init__(self, path: str):
+        self.path = path
+
+        # video_id: [title, author, plays]
+        self._tracks: dict[str, list] = {}
+        # sorted (key, video_id) pairs
+        self._keys: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    @staticmethod
+    def _keys_for(title: str, video_id: str) -> list[tuple[str, str]]:
+        words = normalize_title(title).split(" ")
+        return [(" ".join(words[i:]), video_id) for i in range(len(words)) if words[i]]
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load title index from {self.path}: {e}")
+            return
+
+        keys = []
+        for video_id, (title, _, _) in loaded.items():
+            keys.extend(self._keys_for(title, video_id))
+        # one sort instead of an insert per key
+        keys.sort()
+
+        with self._lock:
+            self._tracks = loaded
+            self._keys = keys
+        logger.info(f"Loaded {len(loaded)} titles into the autocomplete index")
+
+    def save(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self._tracks, ensure_ascii=False)
+            self.dirty = False
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def add(self, info: tracks.TrackInfo):
+        with self._lock:
+            if entry := self._tracks.get(info.video_id):
+                if entry[0] == info.title:
+                    return
+                for key in self._keys_for(entry[0], info.video_id):
+                    self._remove_key(key)
+                entry[0], entry[1] = info.title, info.author
+            else:
+                self._tracks[info.video_id] = [info.title, info.author, 0]
+
+            for key in self._keys_for(info.title, info.video_id):
+                bisect.insort(self._keys, key)
+            self.dirty = True
+
+    def _remove_key(self, key: tuple[str, str]):
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def record_play(self, video_id: str):
+        with self._lock:
+            if entry := self._tracks.get(video_id):
+                entry[2] += 1
+                self.dirty = True
+
+    def lookup(self, prefix: str, limit: int = 25) -> list[tuple[str, str]]:
+        # (video_id, title) of the most played songs with a word starting with prefix
+        prefix = normalize_title(prefix)
+
+        with self._lock:
+            if not prefix:
+                matches = self._tracks.keys()
+            else:
+                matches = set()
+                i = bisect.bisect_left(self._keys, (prefix, ""))
+                while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+                    matches.add(self._keys[i][1])
+                    i += 1
+
+            ranked = heapq.nlargest(limit, matches, key=lambda video_id: self._tracks[video_id][2])
+            return [(video_id, self._tracks[video_id][0]) for video_id in ranked]
+
+    def __len__(self) -> int:
+        return len(self._tracks)
@@ -0,0 +1,128 @@
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+import pytubefix
+
+VIDEO_ID_PATTERN = re.compile(r"^[0-9A-Za-z_-]{11}$")
+# youtube.com/shorts/<id>, /embed/<id>, /live/<id>, /v/<id>
+PATH_PREFIXES = ("shorts", "embed", "live", "v")
+
+def canonical_video_id(link: str) -> str:
+    # every cache is keyed by this so youtu.be/X, watch?v=X&t=10 and music.youtube.com/watch?v=X are the same song
+    link = link.strip()
+    if VIDEO_ID_PATTERN.match(link):
+        return link
+
+    url = urlparse(link if "://" in link else "https://" + link)
+    host = url.netloc.lower().removeprefix("www.").removeprefix("m.")
+    parts = [part for part in url.path.split("/") if part]
+
+    video_id = None
+    if host == "youtu.be" and parts:
+        video_id = parts[0]
+    elif host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        if v := parse_qs(url.query).get("v"):
+            video_id = v[0]
+        elif len(parts) >= 2 and parts[0] in PATH_PREFIXES:
+            video_id = parts[1]
+
+    if video_id and VIDEO_ID_PATTERN.match(video_id):
+        return video_id
+
+    try:
+        return pytubefix.extract.video_id(link)
+    except pytubefix.exceptions.RegexMatchError:
+        raise ValueError(f"No youtube video id in {link}") from None
+
+def watch_url(video_id: str) -> str:
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+def pick_audio_stream(yt: pytubefix.YouTube, prefer_opus: bool = True) -> pytubefix.Stream:
+    audio_streams = yt.streams.filter(only_audio=True)
+    if prefer_opus:
+        # opus can be sent to discord as is, no decoding or encoding needed
+        if opus_stream := audio_streams.filter(audio_codec="opus").order_by("abr").desc().first():
+            return opus_stream
+    return audio_streams.first()
+
+
+class TrackInfo():
+    __slots__ = ("video_id", "title", "author", "duration", "itag", "codec", "extension", "abr", "filesize")
+
+    def __init__(self, video_id: str, title: str, author: str, duration: int, itag: int | None = None,
+                 codec: str | None = None, extension: str | None = None, abr: str | None = None, filesize: int | None = None):
+        self.video_id = video_id
+        self.title = title
+        self.author = author
+        # seconds
+        self.duration = duration
+        self.itag = itag
+        self.codec = codec
+        self.extension = extension
+        self.abr = abr
+        self.filesize = filesize
+
+    @classmethod
+    def from_youtube(cls, video_id: str, yt: pytubefix.YouTube, stream: pytubefix.Stream | None = None) -> "TrackInfo":
+        info = cls(video_id, yt.title, yt.author, yt.length)
+        if stream:
+            info.itag = stream.itag
+            info.codec = stream.audio_codec
+            info.extension = stream.subtype
+            info.abr = stream.abr
+            info.filesize = stream.filesize
+        return info
+
+    @property
+    def url(self) -> str:
+        return watch_url(self.video_id)
+
+    def __repr__(self) -> str:
+        return f"<TrackInfo {self.video_id} '{self.title}' by {self.author}>"
+
+
+class MetadataCache():
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, TrackInfo] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video_id: str) -> TrackInfo | None:
+        with self._lock:
+            info = self._entries.get(video_id)
+            if info is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return info
+
+    def peek(self, video_id: str) -> TrackInfo | None:
+        # for display, doesn't count as a hit or change the lru order
+        return self._entries.get(video_id)
+
+    def put(self, info: TrackInfo):
+        with self._lock:
+            self._entries[info.video_id] = info
+            self._entries.move_to_end(info.video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytubefix
+
+import metrics
+import tracks
+from config import logging
+
+logger = logging.getLogger('discord')
+
+search_seconds = metrics.registry.histogram("musicbot_youtube_search_seconds", "Time taken by searches that went to youtube")
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def parse_duration(text: str | None) -> int:
+    # "1:02:03" -> 3723, live streams have no length
+    if not text:
+        return 0
+    seconds = 0
+    for part in text.split(":"):
+        if not part.isdigit():
+            return 0
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def _text(field: dict | None) -> str:
+    if not field:
+        return ""
+    if "simpleText" in field:
+        return field["simpleText"]
+    return "".join(run.get("text", "") for run in field.get("runs", []))
+
+def _find_video_renderers(node, found: list[dict]):
+    if isinstance(node, dict):
+        if renderer := node.get("videoRenderer"):
+            found.append(renderer)
+            return
+        for value in node.values():
+            _find_video_renderers(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _find_video_renderers(value, found)
+
+
+class SearchCache():
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # normalized query: (time stored, results)
+        self._entries: OrderedDict[str, tuple[float, list[tracks.TrackInfo]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> list[tracks.TrackInfo] | None:
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[query]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(query)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, results: list[tracks.TrackInfo]):
+        with self._lock:
+            self._entries[query] = (time.monotonic(), results)
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class YouTubeSearcher():
+    def __init__(self, search_cache: SearchCache, max_workers: int = 2, max_results: int = 10):
+        self.cache = search_cache
+        self.max_results = max_results
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="youtube-search")
+        self._pending: dict[str, asyncio.Future] = {}
+
+    async def search(self, query: str, limit: int = 5) -> list[tracks.TrackInfo]:
+        key = normalize_query(query)
+        if (results := self.cache.get(key)) is not None:
+            return results[:limit]
+
+        # the same query from several guilds at once only goes to youtube once
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self._search_youtube, key)
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        results = await asyncio.shield(future)
+        return results[:limit]
+
+    def _search_youtube(self, query: str) -> list[tracks.TrackInfo]:
+        start = time.perf_counter()
+
+        # the raw results already have title, channel and length, reading them off the
+        # YouTube objects in search.videos would cost a request per video
+        renderers: list[dict] = []
+        _find_video_renderers(pytubefix.Search(query).fetch_query(), renderers)
+
+        results = []
+        for renderer in renderers[:self.max_results]:
+            results.append(tracks.TrackInfo(
+                renderer["videoId"],
+                _text(renderer.get("title")),
+                _text(renderer.get("ownerText") or renderer.get("longBylineText")),
+                parse_duration(_text(renderer.get("lengthText")))
+            ))
+
+        elapsed = time.perf_counter() - start
+        search_seconds.observe(elapsed)
+        logger.info(f"Searched youtube for '{query}' in {elapsed:.2f}s, {len(results)} results")
+
+        self.cache.put(query, results)
+        return results